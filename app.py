@@ -1,65 +1,107 @@
-from flask import Flask, url_for
+from flask import Flask
 from models import db, User
 from routes import init_app
 from werkzeug.security import generate_password_hash
 from dotenv import load_dotenv
 from pathlib import Path
 import os
+import click
 from prefix_middleware import PrefixMiddleware
+from logging_setup import configure_logging
+from assets import asset_manifest
+import metrics
+import database
+import migrations
 from werkzeug.middleware.proxy_fix import ProxyFix
+import logging
 
-# Load environment variables
-env_path = Path(__file__).parent / '.env'
-load_dotenv(dotenv_path=env_path)
-
-# Check if running behind proxy
-behind_proxy = os.getenv('BEHIND_PROXY', 'false').lower() == 'true'
-prefix = '/discount-system' if behind_proxy else ''
-print(f"Using URL prefix: '{prefix}'")
-
-# Initialize Flask app
-app = Flask(__name__, 
-           static_url_path='/static',  # Simple static path, we'll adjust it if needed
-           static_folder='static')
-
-# Configure app to work behind a proxy
-app.wsgi_app = ProxyFix(app.wsgi_app, x_for=1, x_proto=1, x_host=1, x_prefix=1)
-
-# Direct route handler for static files with the prefix
-@app.route('/discount-system/static/<path:filename>')
-def custom_static(filename):
-    print(f"Custom static file request for: {filename}")
-    return app.send_static_file(filename)
-
-# Configure app
-app.config.update(
-    SERVER_NAME=None,  # Set to None to avoid URL generation issues
-    SQLALCHEMY_DATABASE_URI=os.getenv('SQLALCHEMY_DATABASE_URI'),
-    SQLALCHEMY_TRACK_MODIFICATIONS=False,
-    SECRET_KEY=os.getenv('SECRET_KEY', 'default-secret-key'),
-    APPLICATION_ROOT=prefix,
-    PREFERRED_URL_SCHEME='http',
-    MAX_CONTENT_LENGTH=100 * 1024 * 1024  # 100MB max upload size
-)
-
-# Initialize database
-db.init_app(app)
-
-# Apply PrefixMiddleware if running behind proxy
-if behind_proxy:
-    app.wsgi_app = PrefixMiddleware(app.wsgi_app, app=app, prefix=prefix)
-    print(f"Applied PrefixMiddleware with prefix: {prefix}")
+logger = logging.getLogger(__name__)
+
+
+def create_app(instance_path=None):
+    """
+    Create and configure the Flask application.
     
-    # Test URL generation to debug
-    with app.test_request_context():
-        print(f"Test static URL: {url_for('static', filename='css/common.css')}")
+    :param instance_path: Absolute path of the instance folder (defaults to ./instance)
+    """
+    # Load environment variables
+    env_path = Path(__file__).parent / '.env'
+    load_dotenv(dotenv_path=env_path)
+
+    # Check if running behind proxy
+    behind_proxy = os.getenv('BEHIND_PROXY', 'false').lower() == 'true'
+    prefix = '/discount-system' if behind_proxy else ''
+
+    # Initialize Flask app
+    app = Flask(__name__, 
+               static_url_path='/static',  # Simple static path, we'll adjust it if needed
+               static_folder='static',
+               instance_path=instance_path)
+    configure_logging(app)
+    logger.info("Using URL prefix: '%s'", prefix)
+
+    # Configure app to work behind a proxy
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=1, x_proto=1, x_host=1, x_prefix=1)
+
+    # Hashed, precompressed assets from `python assets.py`, when they have been built
+    asset_manifest.init_app(app)
+
+    # Direct route handler for static files with the prefix
+    @app.route('/discount-system/static/<path:filename>')
+    def custom_static(filename):
+        return asset_manifest.send_static_file(filename)
+
+    # Configure app
+    app.config.update(
+        SERVER_NAME=None,  # Set to None to avoid URL generation issues
+        SQLALCHEMY_DATABASE_URI=os.getenv('SQLALCHEMY_DATABASE_URI'),
+        SQLALCHEMY_TRACK_MODIFICATIONS=False,
+        SECRET_KEY=os.getenv('SECRET_KEY', 'default-secret-key'),
+        APPLICATION_ROOT=prefix,
+        PREFERRED_URL_SCHEME='http',
+        MAX_CONTENT_LENGTH=100 * 1024 * 1024  # 100MB max upload size
+    )
+
+    # Initialize database: pool settings and the optional read replica come from the environment
+    database.configure(app)
+    db.init_app(app)
+
+    # Apply PrefixMiddleware if running behind proxy
+    if behind_proxy:
+        app.wsgi_app = PrefixMiddleware(app.wsgi_app, app=app, prefix=prefix)
+
+    # Register all blueprints
+    init_app(app)
+    metrics.init_app(app, db)
+
+    @app.cli.command('init-db')
+    def init_db():
+        """Apply pending schema migrations. Run once per deploy, before the workers start."""
+        applied = migrations.upgrade()
+        if applied:
+            logger.info("Applied schema migrations: %s", ', '.join(map(str, applied)))
+
+    @app.cli.command('sync-sqlite')
+    @click.option('--full', is_flag=True, help='Read the whole table instead of continuing from the last watermark.')
+    def sync_sqlite(full):
+        """Sync discounts from the SQLite source (DB_FILE_PATH, SQLITE_SOURCE_TABLE)."""
+        # Imported here: the serving processes never need the pandas import stack
+        from services import DataSyncService
+        print(DataSyncService().sync_from_sqlite(incremental=not full))
+
+    @app.cli.command('schema-version')
+    def schema_version():
+        """Print the schema version of the database."""
+        print(migrations.current_version())
+
+    return app
 
-# Register all blueprints
-init_app(app)
 
 if __name__ == '__main__':
+    # Development server; production runs wsgi:app under gunicorn
+    app = create_app()
     with app.app_context():
-        # Create all database tables
-        db.create_all()
+        # Create or upgrade the database schema
+        migrations.upgrade()
     # Run the application
-    app.run(host='0.0.0.0', port=80, debug=True)
\ No newline at end of file
+    app.run(host='0.0.0.0', port=80, debug=True)
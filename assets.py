@@ -0,0 +1,156 @@
+import os
+import re
+import gzip
+import json
+import hashlib
+import logging
+import mimetypes
+import posixpath
+from typing import Dict
+from flask import request, send_from_directory
+
+logger = logging.getLogger(__name__)
+
+try:
+    import brotli
+except ImportError:  # Optional: without it only gzip copies are built
+    brotli = None
+
+DIST_DIR = 'dist'
+MANIFEST_NAME = 'manifest.json'
+ASSET_EXTENSIONS = ('.css', '.js', '.svg')
+COMPRESSIBLE_EXTENSIONS = ('.css', '.js', '.svg')
+ONE_YEAR = 365 * 24 * 3600
+
+CSS_COMMENT = re.compile(r'/\*.*?\*/', re.S)
+CSS_SPACE = re.compile(r'\s+')
+CSS_PUNCTUATION = re.compile(r'\s*([{};,>])\s*')
+CSS_AFTER_COLON = re.compile(r':\s+')
+JS_BLOCK_COMMENT = re.compile(r'^\s*/\*.*?\*/\s*$', re.S | re.M)
+JS_LINE_COMMENT = re.compile(r'^\s*//.*$', re.M)
+
+
+def minify_css(text: str) -> str:
+    text = CSS_COMMENT.sub('', text)
+    text = CSS_SPACE.sub(' ', text)
+    text = CSS_PUNCTUATION.sub(r'\1', text)
+    # Space before a colon is significant in selectors ("a :hover"), after it never is
+    text = CSS_AFTER_COLON.sub(':', text)
+    return text.replace(';}', '}').strip()
+
+
+def minify_js(text: str) -> str:
+    """Conservative: drops whole-line comments, indentation and blank lines, never touches code."""
+    text = JS_BLOCK_COMMENT.sub('', text)
+    text = JS_LINE_COMMENT.sub('', text)
+    return '\n'.join(line.strip() for line in text.splitlines() if line.strip()) + '\n'
+
+
+MINIFIERS = {'.css': minify_css, '.js': minify_js}
+
+
+def build(static_folder: str) -> Dict[str, str]:
+    """
+    Write content-hashed, minified and precompressed copies of the static assets.
+
+    Output goes to <static_folder>/dist along with manifest.json, which maps each
+    source path (e.g. css/common.css) to its hashed copy (dist/css/common.1a2b3c4d5e.css).
+    Every hashed file gets a .gz sibling, and a .br one when brotli is installed.
+
+    :param static_folder: Flask static folder
+    :return: The manifest
+    """
+    dist = os.path.join(static_folder, DIST_DIR)
+    manifest = {}
+    for root, dirs, files in os.walk(static_folder):
+        if os.path.abspath(root) == os.path.abspath(static_folder):
+            dirs[:] = [name for name in dirs if name != DIST_DIR]
+        for name in sorted(files):
+            base, extension = os.path.splitext(name)
+            if extension not in ASSET_EXTENSIONS:
+                continue
+            source = os.path.join(root, name)
+            relative = os.path.relpath(source, static_folder).replace(os.sep, '/')
+            with open(source, 'rb') as f:
+                content = f.read()
+            if extension in MINIFIERS:
+                content = MINIFIERS[extension](content.decode('utf-8')).encode('utf-8')
+            digest = hashlib.sha256(content).hexdigest()[:10]
+            hashed = posixpath.join(DIST_DIR, posixpath.dirname(relative), f"{base}.{digest}{extension}")
+            target = os.path.join(static_folder, hashed)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            with open(target, 'wb') as f:
+                f.write(content)
+            if extension in COMPRESSIBLE_EXTENSIONS:
+                with open(target + '.gz', 'wb') as f:
+                    f.write(gzip.compress(content, compresslevel=9, mtime=0))
+                if brotli is not None:
+                    with open(target + '.br', 'wb') as f:
+                        f.write(brotli.compress(content))
+            manifest[relative] = hashed
+            logger.info("Built %s -> %s", relative, hashed)
+    os.makedirs(dist, exist_ok=True)
+    with open(os.path.join(dist, MANIFEST_NAME), 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    return manifest
+
+
+class AssetManifest:
+    """
+    Serves the output of build().
+
+    url_for('static', filename='css/common.css') resolves to the hashed copy, which
+    is sent precompressed when the client accepts it and marked immutable for a year:
+    its name changes whenever its content does. Without a built manifest, as in
+    development, the source files are served as before.
+    """
+
+    def __init__(self):
+        self.app = None
+        self.manifest: Dict[str, str] = {}
+        self.hashed = set()
+
+    def init_app(self, app):
+        self.app = app
+        path = os.path.join(app.static_folder, DIST_DIR, MANIFEST_NAME)
+        try:
+            with open(path) as f:
+                self.manifest = json.load(f)
+        except FileNotFoundError:
+            logger.info("No asset manifest at %s, serving unhashed static files", path)
+        self.hashed = set(self.manifest.values())
+        app.extensions['assets'] = self
+        app.url_defaults(self.hashed_url)
+        app.view_functions['static'] = self.send_static_file
+
+    def hashed_url(self, endpoint: str, values: dict):
+        """url_defaults hook swapping a static file name for its hashed copy."""
+        if endpoint == 'static' and 'filename' in values:
+            values['filename'] = self.manifest.get(values['filename'], values['filename'])
+
+    def send_static_file(self, filename: str):
+        if filename not in self.hashed:
+            return self.app.send_static_file(filename)
+        path, encoding = filename, None
+        for candidate, suffix in (('br', '.br'), ('gzip', '.gz')):
+            if (candidate in request.accept_encodings
+                    and os.path.exists(os.path.join(self.app.static_folder, filename + suffix))):
+                path, encoding = filename + suffix, candidate
+                break
+        response = send_from_directory(self.app.static_folder, path,
+                                       mimetype=mimetypes.guess_type(filename)[0], max_age=ONE_YEAR)
+        if encoding:
+            response.headers['Content-Encoding'] = encoding
+        response.vary.add('Accept-Encoding')
+        response.cache_control.public = True
+        response.cache_control.immutable = True
+        return response
+
+
+asset_manifest = AssetManifest()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    static = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
+    print(f"Built {len(build(static))} assets")
@@ -0,0 +1,178 @@
+"""
+Benchmarks for the sync and lookup hot paths.
+
+Generates synthetic workbooks with the real sheet schema, times
+DataSyncService.sync_from_upload end to end against a throwaway SQLite database and
+load-tests /api/discounts and / through the Flask test client. Results are printed
+as JSON so runs on different commits can be compared:
+
+    python benchmarks/bench.py --sizes 1000 10000 --output before.json
+    python benchmarks/bench.py --sizes 1000 10000 --compare before.json
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import tempfile
+import statistics
+import subprocess
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+SHEET_NAME = 'Скидки'
+COLUMNS = ['Название', 'Тип', 'Вид оплаты', 'Скидка МПП', 'Скидка РОП', 'Скидка КД']
+HEADERS = {'X-User-Name': 'bench', 'X-User-Roles': 'discount-admin', 'X-User-Full-Name': 'Bench'}
+
+
+def generate_workbook(path: Path, rows: int, seed: int = 42):
+    """Write a workbook of `rows` unique combinations in the import schema."""
+    import openpyxl
+
+    rng = random.Random(seed)
+    workbook = openpyxl.Workbook(write_only=True)
+    sheet = workbook.create_sheet(SHEET_NAME)
+    sheet.append(COLUMNS)
+    types = [f'Тип {i}' for i in range(10)]
+    payments = [f'Оплата {i}' for i in range(10)]
+    for i in range(rows):
+        sheet.append([
+            f'ЖК Проект-{i // 100}',
+            types[(i // 10) % 10],
+            payments[i % 10],
+            round(rng.uniform(0, 0.1), 4),
+            round(rng.uniform(0, 0.1), 4),
+            round(rng.uniform(0, 0.05), 4) if i % 7 else None,
+        ])
+    workbook.save(path)
+
+
+def timed(func, *args):
+    started = time.perf_counter()
+    result = func(*args)
+    return time.perf_counter() - started, result
+
+
+def bench_sync(app, workbook: Path, changed_workbook: Path) -> dict:
+    """Import into an empty database, re-upload the same file, then a file with new values."""
+    from models import db
+    from migrations import upgrade, schema_metadata
+    from services import DataSyncService
+
+    results = {}
+    with app.app_context():
+        db.drop_all()
+        schema_metadata.drop_all(bind=db.engine)
+        upgrade()
+        for label, path in (('initial', workbook), ('identical', workbook), ('changed', changed_workbook)):
+            with open(path, 'rb') as f:
+                elapsed, report = timed(DataSyncService().sync_from_upload, f)
+            results[label] = {
+                'seconds': round(elapsed, 4),
+                'rows_per_second': round(report.processed / elapsed, 1) if report.processed else None,
+                'inserted': report.inserted,
+                'updated': report.updated,
+            }
+    return results
+
+
+def bench_requests(client, url: str, count: int) -> dict:
+    latencies = []
+    for _ in range(count):
+        started = time.perf_counter()
+        response = client.get(url, headers=HEADERS)
+        latencies.append(time.perf_counter() - started)
+        if response.status_code != 200:
+            raise RuntimeError(f'{url} returned {response.status_code}')
+    latencies.sort()
+    total = sum(latencies)
+    return {
+        'requests': count,
+        'requests_per_second': round(count / total, 1),
+        'mean_ms': round(statistics.mean(latencies) * 1000, 3),
+        'p50_ms': round(latencies[len(latencies) // 2] * 1000, 3),
+        'p95_ms': round(latencies[int(len(latencies) * 0.95) - 1] * 1000, 3),
+    }
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def compare(current: dict, previous: dict) -> list:
+    """Relative change of every numeric leaf present in both result sets."""
+    changes = []
+
+    def walk(now, before, path):
+        if isinstance(now, dict) and isinstance(before, dict):
+            for key in now:
+                if key in before:
+                    walk(now[key], before[key], f'{path}.{key}' if path else key)
+        elif isinstance(now, (int, float)) and isinstance(before, (int, float)) \
+                and not isinstance(now, bool) and before:
+            changes.append({'metric': path, 'before': before, 'after': now,
+                            'change_pct': round((now - before) / before * 100, 1)})
+
+    walk(current.get('results', {}), previous.get('results', {}), '')
+    return changes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--requests', type=int, default=500, help='requests per endpoint')
+    parser.add_argument('--output', help='write the JSON results to this file')
+    parser.add_argument('--compare', help='previous results file to compare against')
+    args = parser.parse_args()
+
+    workdir = Path(tempfile.mkdtemp(prefix='discount-bench-'))
+    os.environ.update({
+        'SQLALCHEMY_DATABASE_URI': f"sqlite:///{workdir / 'bench.sqlite3'}",
+        'EXCEL_SHEET_NAME': SHEET_NAME,
+        'EXCEL_COLUMNS': ','.join(COLUMNS),
+        'IMPORT_WORKERS': '0',
+        'LOG_LEVEL': 'WARNING',
+    })
+    from app import create_app
+    app = create_app(instance_path=str(workdir / 'instance'))
+
+    results = {}
+    for size in args.sizes:
+        workbook = workdir / f'discounts-{size}.xlsx'
+        changed_workbook = workdir / f'discounts-{size}-changed.xlsx'
+        generate_workbook(workbook, size)
+        generate_workbook(changed_workbook, size, seed=7)
+        entry = {'sync': bench_sync(app, workbook, changed_workbook)}
+
+        client = app.test_client()
+        client.get('/', headers=HEADERS)  # warm up user and discount caches
+        entry['api_discounts'] = bench_requests(
+            client, '/api/discounts?complex_id=1&type_id=1&payment_type_id=1', args.requests)
+        entry['dashboard'] = bench_requests(client, '/', args.requests)
+        results[str(size)] = entry
+
+    output = {
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'results': results,
+    }
+    if args.compare:
+        with open(args.compare) as f:
+            output['comparison'] = compare(output, json.load(f))
+
+    text = json.dumps(output, ensure_ascii=False, indent=2)
+    if args.output:
+        Path(args.output).write_text(text, encoding='utf-8')
+    print(text)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,145 @@
+"""
+Cold-start regression check for the serving processes.
+
+Starts fresh interpreters that build the app the way a gunicorn worker does
+(wsgi.py), serve / and /api/discounts once, and report the import time, the time
+to the first response and the resident memory. Fails when a budget is exceeded or
+when a module of the Excel import stack was loaded, since serving processes must
+never pay for it:
+
+    python benchmarks/startup.py
+    python benchmarks/startup.py --max-startup-ms 1500 --max-rss-mb 120 --output startup.json
+"""
+import os
+import sys
+import json
+import argparse
+import platform
+import tempfile
+import statistics
+import subprocess
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from bench import HEADERS, git_commit, compare  # noqa: E402
+
+# Only the import and sync jobs may load these
+FORBIDDEN_MODULES = ('pandas', 'numpy', 'openpyxl', 'services')
+
+# Budgets with headroom over a python:3.12-slim worker; lower them as the import graph shrinks
+DEFAULT_MAX_STARTUP_MS = 2000
+DEFAULT_MAX_RSS_MB = 150
+
+WORKER = """
+import os, sys, json, time
+started = time.perf_counter()
+from app import create_app
+app = create_app(instance_path=os.environ['BENCH_INSTANCE'])
+imported = time.perf_counter()
+client = app.test_client()
+for url in ('/', '/api/discounts?complex_id=1&type_id=1&payment_type_id=1'):
+    status = client.get(url, headers=json.loads(os.environ['BENCH_HEADERS'])).status_code
+    if status != 200:
+        raise SystemExit(f'{url} returned {status}')
+served = time.perf_counter()
+
+
+def rss_mb():
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+
+
+print(json.dumps({
+    'import_ms': (imported - started) * 1000,
+    'first_response_ms': (served - started) * 1000,
+    'rss_mb': rss_mb(),
+    'modules': sorted(name for name in json.loads(os.environ['BENCH_FORBIDDEN']) if name in sys.modules),
+}))
+"""
+
+
+def run_worker(env: dict) -> dict:
+    """Measure one cold start in a new interpreter."""
+    output = subprocess.run([sys.executable, '-c', WORKER], cwd=ROOT, env=env,
+                            capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def measure(runs: int, workdir: Path) -> dict:
+    env = dict(os.environ)
+    env.update({
+        'SQLALCHEMY_DATABASE_URI': f"sqlite:///{workdir / 'startup.sqlite3'}",
+        'IMPORT_WORKERS': '0',
+        'MAIL_WORKERS': '0',
+        'LOG_LEVEL': 'WARNING',
+        'PYTHONPATH': str(ROOT),
+        'BENCH_INSTANCE': str(workdir / 'instance'),
+        'BENCH_HEADERS': json.dumps(HEADERS),
+        'BENCH_FORBIDDEN': json.dumps(FORBIDDEN_MODULES),
+    })
+    # Create the schema once, so the measured runs only read
+    subprocess.run([sys.executable, '-c', 'import os, migrations; from app import create_app\n'
+                    'with create_app(instance_path=os.environ["BENCH_INSTANCE"]).app_context(): migrations.upgrade()'],
+                   cwd=ROOT, env=env, check=True, capture_output=True)
+    samples = [run_worker(env) for _ in range(runs)]
+    return {
+        'runs': runs,
+        'import_ms': round(statistics.median(s['import_ms'] for s in samples), 1),
+        'first_response_ms': round(statistics.median(s['first_response_ms'] for s in samples), 1),
+        'rss_mb': round(statistics.median(s['rss_mb'] for s in samples), 1),
+        'forbidden_modules': sorted({name for s in samples for name in s['modules']}),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5, help='cold starts to take the median of')
+    parser.add_argument('--max-startup-ms', type=float,
+                        default=float(os.getenv('STARTUP_MAX_MS', DEFAULT_MAX_STARTUP_MS)),
+                        help='budget for the time to the first response')
+    parser.add_argument('--max-rss-mb', type=float,
+                        default=float(os.getenv('STARTUP_MAX_RSS_MB', DEFAULT_MAX_RSS_MB)),
+                        help='budget for the resident memory after the first responses')
+    parser.add_argument('--output', help='write the JSON results to this file')
+    parser.add_argument('--compare', help='previous results file to compare against')
+    args = parser.parse_args()
+
+    results = measure(args.runs, Path(tempfile.mkdtemp(prefix='discount-startup-')))
+    failures = []
+    if results['forbidden_modules']:
+        failures.append(f"serving path imported {', '.join(results['forbidden_modules'])}")
+    if results['first_response_ms'] > args.max_startup_ms:
+        failures.append(f"first response after {results['first_response_ms']} ms, "
+                        f"budget {args.max_startup_ms:g} ms")
+    if results['rss_mb'] > args.max_rss_mb:
+        failures.append(f"RSS {results['rss_mb']} MB, budget {args.max_rss_mb:g} MB")
+
+    output = {
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'results': results,
+        'failures': failures,
+    }
+    if args.compare:
+        with open(args.compare) as f:
+            output['comparison'] = compare(output, json.load(f))
+
+    text = json.dumps(output, ensure_ascii=False, indent=2)
+    if args.output:
+        Path(args.output).write_text(text, encoding='utf-8')
+    print(text)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+import re
+import json
+from typing import Dict, Any, List
+
+SECTION_TITLE = 'Изменение максимальных скидок'
+
+# Compiled once at import instead of on every render
+SECTION_PATTERN = re.compile(r'(Изменение максимальных скидок)')
+PROJECT_PATTERN = re.compile(r'([A-Za-zА-Яа-я\'\d-]+\s[A-Za-zА-Яа-я\'\d-]+(?:\s\(\d\))?\s*-)')
+DOUBLE_NEWLINE_PATTERN = re.compile(r'\n\n')
+ENTRY_PATTERN = re.compile(r'^(?P<project>[A-Za-zА-Яа-я\'\d-]+\s[A-Za-zА-Яа-я\'\d-]+(?:\s\(\d\))?)\s*-\s*(?P<text>.*)$')
+
+
+def format_comment_text(text: str) -> str:
+    """
+    Put every section header and project entry of a comment on its own line.
+
+    :param text: Raw comment text
+    :return: Text with line breaks
+    """
+    # Add line breaks before section headers
+    text = SECTION_PATTERN.sub(r'\n\1', text)
+    
+    # Add line breaks before project entries
+    text = PROJECT_PATTERN.sub(r'\n\1', text)
+    
+    # Handle special cases for project names with numbers
+    text = DOUBLE_NEWLINE_PATTERN.sub(r'\n', text)
+    
+    # Remove leading newline if present
+    if text.startswith('\n'):
+        text = text[1:]
+        
+    return text
+
+
+def parse_comment(formatted: str) -> Dict[str, Any]:
+    """
+    Split a formatted comment into sections and per-project entries.
+
+    :param formatted: Output of format_comment_text
+    :return: {"sections": [{"title": str or None, "entries": [{"project": str or None, "text": str}]}]}
+    """
+    sections: List[Dict[str, Any]] = []
+    current = None
+    for line in formatted.split('\n'):
+        line = line.strip()
+        if not line:
+            continue
+        if line.startswith(SECTION_TITLE):
+            current = {'title': SECTION_TITLE, 'entries': []}
+            sections.append(current)
+            line = line[len(SECTION_TITLE):].strip(' :')
+            if not line:
+                continue
+        if current is None:
+            current = {'title': None, 'entries': []}
+            sections.append(current)
+        match = ENTRY_PATTERN.match(line)
+        if match:
+            current['entries'].append({'project': match.group('project'), 'text': match.group('text').strip()})
+        else:
+            current['entries'].append({'project': None, 'text': line})
+    return {'sections': sections}
+
+
+def build_comment_format(text: str) -> Dict[str, str]:
+    """
+    Formatted text and JSON structure of a comment, computed once when it is saved.
+
+    :param text: Raw comment text
+    :return: Column values for CommentFormat
+    """
+    formatted = format_comment_text(text)
+    return {
+        'formatted_text': formatted,
+        'structure': json.dumps(parse_comment(formatted), ensure_ascii=False),
+    }
@@ -0,0 +1,93 @@
+import os
+import time
+import logging
+from typing import Any, Dict
+from flask import current_app
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import QueuePool
+from models import db
+from metrics import DB_POOL_CHECKOUT
+
+logger = logging.getLogger(__name__)
+
+REPLICA_BIND = 'replica'
+
+
+def _timed_pool(bind: str):
+    """QueuePool subclass reporting checkout wait to DB_POOL_CHECKOUT under `bind`."""
+
+    class TimedQueuePool(QueuePool):
+        def connect(self):
+            started = time.perf_counter()
+            try:
+                return super().connect()
+            finally:
+                DB_POOL_CHECKOUT.labels(bind).observe(time.perf_counter() - started)
+
+    return TimedQueuePool
+
+
+def engine_options(uri: str, bind: str = 'primary') -> Dict[str, Any]:
+    """
+    SQLAlchemy engine options read from the environment.
+
+    DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT (seconds to wait for a free
+    connection), DB_POOL_RECYCLE (seconds; keep it below MySQL's wait_timeout),
+    DB_POOL_PRE_PING, DB_CONNECT_TIMEOUT, DB_READ_TIMEOUT and DB_WRITE_TIMEOUT.
+
+    :param uri: Database URI the options are for
+    :param bind: Label of the pool in the checkout metric
+    :return: Keyword arguments for create_engine
+    """
+    url = make_url(uri)
+    if url.get_backend_name() == 'sqlite' and url.database in (None, '', ':memory:'):
+        return {}  # In-memory SQLite needs its single-connection pool
+    options: Dict[str, Any] = {
+        'poolclass': _timed_pool(bind),
+        'pool_size': int(os.getenv('DB_POOL_SIZE', 5)),
+        'max_overflow': int(os.getenv('DB_MAX_OVERFLOW', 10)),
+        'pool_timeout': float(os.getenv('DB_POOL_TIMEOUT', 30)),
+        'pool_recycle': int(os.getenv('DB_POOL_RECYCLE', 280)),
+        'pool_pre_ping': os.getenv('DB_POOL_PRE_PING', 'true').lower() == 'true',
+    }
+    if url.get_backend_name() == 'mysql':
+        options['connect_args'] = {
+            'connect_timeout': int(os.getenv('DB_CONNECT_TIMEOUT', 10)),
+            'read_timeout': int(os.getenv('DB_READ_TIMEOUT', 60)),
+            'write_timeout': int(os.getenv('DB_WRITE_TIMEOUT', 60)),
+        }
+    return options
+
+
+def configure(app):
+    """
+    Put the engine options, and the replica bind if DATABASE_REPLICA_URI is set, into app.config.
+
+    Must run before db.init_app(app).
+    """
+    uri = app.config['SQLALCHEMY_DATABASE_URI']
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(uri)
+    replica_uri = os.getenv('DATABASE_REPLICA_URI')
+    if replica_uri:
+        app.config['SQLALCHEMY_BINDS'] = {REPLICA_BIND: {'url': replica_uri, **engine_options(replica_uri, REPLICA_BIND)}}
+        logger.info("Read-only queries use the replica at %s", make_url(replica_uri).render_as_string(hide_password=True))
+    app.config['DATABASE_REPLICA_MAX_LAG'] = float(os.getenv('DATABASE_REPLICA_MAX_LAG', 5))
+
+
+def read_bind_arguments(changed_at_ns: int = 0) -> Dict[str, Any]:
+    """
+    Bind arguments routing a read-only statement to the replica, when one is configured.
+
+    Results are cached per data version, and the generation counters are timestamps
+    of the last change. Data changed less than DATABASE_REPLICA_MAX_LAG seconds ago
+    may not have reached the replica yet, so it is read from the primary instead.
+
+    :param changed_at_ns: Generation (time.time_ns() of the last change) of the data being read
+    :return: Keyword arguments for db.session.execute
+    """
+    engine = db.engines.get(REPLICA_BIND)
+    if engine is None:
+        return {}
+    if time.time_ns() - changed_at_ns < current_app.config['DATABASE_REPLICA_MAX_LAG'] * 1e9:
+        return {}
+    return {'bind_arguments': {'bind': engine}}
@@ -0,0 +1,191 @@
+import os
+import time
+import logging
+import threading
+from array import array
+from typing import Optional, Dict, Tuple, List, Iterable
+from models import db, DiscountObject
+from metrics import DISCOUNT_CACHE_LOOKUPS
+from database import read_bind_arguments
+
+logger = logging.getLogger(__name__)
+
+
+class GenerationCounter:
+    """
+    Data version shared between worker processes.
+
+    The value lives in a small file on the instance volume, so every worker of the
+    container sees a bump made by any other worker.
+    """
+
+    def __init__(self, name: str, path: Optional[str] = None):
+        self.name = name
+        self.path = path
+
+    def init_app(self, app):
+        os.makedirs(app.instance_path, exist_ok=True)
+        self.path = os.path.join(app.instance_path, f"{self.name}.generation")
+
+    def read(self) -> int:
+        """Return the current generation, 0 if nothing has been published yet."""
+        try:
+            with open(self.path, 'r') as f:
+                return int(f.read().strip() or 0)
+        except (OSError, ValueError):
+            return 0
+
+    def bump(self) -> int:
+        """Publish a new generation and return it."""
+        # Nanosecond timestamps keep generations unique without a cross-process lock
+        generation = max(time.time_ns(), self.read() + 1)
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as f:
+            f.write(str(generation))
+        os.replace(tmp_path, self.path)
+        return generation
+
+
+class DiscountMatrixCache:
+    """
+    In-process index of the whole discount matrix.
+
+    Keys are (complex_id, type_id, payment_type_id) triples mapped to a slot in a flat
+    array of doubles holding (mpp, opt, kd) for each combination, with secondary
+    indexes of the keys per complex and per payment type. The index is rebuilt as a
+    whole and swapped in with a single assignment, so lookups never need a lock.
+    """
+
+    def __init__(self, check_interval: float = 1.0):
+        self.generation = GenerationCounter('discounts')
+        self.check_interval = check_interval
+        self._state = None  # (generation, index, values, by_complex, by_payment_type)
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.generation.init_app(app)
+        self.check_interval = float(os.getenv('DISCOUNT_CACHE_CHECK_INTERVAL', self.check_interval))
+        app.extensions['discount_cache'] = self
+
+    def get(self, complex_id: int, type_id: int, payment_type_id: int) -> Optional[Tuple[float, float, float]]:
+        """
+        Look up the discounts of one combination.
+
+        :return: (mpp_discount, opt_discount, kd_discount) or None if the combination is unknown
+        """
+        _, index, values, _, _ = self._lookup_state()
+        slot = index.get((complex_id, type_id, payment_type_id))
+        if slot is None:
+            return None
+        return values[slot], values[slot + 1], values[slot + 2]
+
+    def version(self) -> int:
+        """Generation of the matrix this worker currently serves."""
+        return self._fresh_state()[0]
+
+    def get_many(self, keys: Iterable[Tuple[int, int, int]]) -> List[Tuple[Tuple[int, int, int], Tuple[float, float, float]]]:
+        """
+        Look up several combinations against one snapshot of the matrix.
+
+        :param keys: (complex_id, type_id, payment_type_id) triples
+        :return: (key, (mpp, opt, kd)) pairs for the keys that exist, in request order
+        """
+        _, index, values, _, _ = self._lookup_state()
+        found = []
+        for key in keys:
+            slot = index.get(key)
+            if slot is not None:
+                found.append((key, (values[slot], values[slot + 1], values[slot + 2])))
+        return found
+
+    def select(self, complex_id: Optional[int] = None, type_id: Optional[int] = None,
+               payment_type_id: Optional[int] = None) -> List[Tuple[Tuple[int, int, int], Tuple[float, float, float]]]:
+        """
+        All combinations matching the given ids; omitted ids match anything.
+
+        :return: (key, (mpp, opt, kd)) pairs
+        """
+        _, index, values, by_complex, by_payment_type = self._fresh_state()
+        if complex_id is not None:
+            keys = by_complex.get(complex_id, ())
+        elif payment_type_id is not None:
+            keys = by_payment_type.get(payment_type_id, ())
+        else:
+            keys = index.keys()
+        found = []
+        for key in keys:
+            if ((type_id is None or key[1] == type_id)
+                    and (payment_type_id is None or key[2] == payment_type_id)):
+                slot = index[key]
+                found.append((key, (values[slot], values[slot + 1], values[slot + 2])))
+        return found
+
+    def reload(self):
+        """Rebuild the index from the database."""
+        with self._lock:
+            self._state = self._load()
+            self._checked_at = time.monotonic()
+
+    def invalidate(self):
+        """Publish a new data version to all workers and rebuild the local index, if any."""
+        self.generation.bump()
+        # A process that never served a lookup, such as the import worker, has nothing to rebuild
+        if self._state is not None:
+            self.reload()
+
+    def _fresh_state(self):
+        return self._refresh()[0]
+
+    def _lookup_state(self):
+        """_fresh_state for get and get_many, counted as a cache hit or a reload."""
+        state, reloaded = self._refresh()
+        DISCOUNT_CACHE_LOOKUPS.labels('reload' if reloaded else 'hit').inc()
+        return state
+
+    def _refresh(self):
+        state = self._state
+        now = time.monotonic()
+        if state is not None and now - self._checked_at < self.check_interval:
+            return state, False
+        self._checked_at = now
+        if state is None or state[0] != self.generation.read():
+            with self._lock:
+                # Another thread may have reloaded while we waited for the lock
+                state = self._state
+                if state is None or state[0] != self.generation.read():
+                    state = self._state = self._load()
+                    return state, True
+        return state, False
+
+    def _load(self):
+        # Read the generation first: a sync committing during the load bumps it again
+        # and the next check picks that up.
+        generation = self.generation.read()
+        started = time.perf_counter()
+        rows = db.session.execute(db.select(
+            DiscountObject.complex_id,
+            DiscountObject.type_id,
+            DiscountObject.payment_type_id,
+            DiscountObject.mpp_discount,
+            DiscountObject.opt_discount,
+            DiscountObject.kd_discount,
+        ).order_by(DiscountObject.id), **read_bind_arguments(generation))
+        index: Dict[Tuple[int, int, int], int] = {}
+        values = array('d')
+        by_complex: Dict[int, List[Tuple[int, int, int]]] = {}
+        by_payment_type: Dict[int, List[Tuple[int, int, int]]] = {}
+        for complex_id, type_id, payment_type_id, mpp, opt, kd in rows:
+            key = (complex_id, type_id, payment_type_id)
+            if key in index:
+                continue  # Keep the oldest row, as the former .first() lookup did
+            index[key] = len(values)
+            values.extend((mpp or 0.0, opt or 0.0, kd or 0.0))
+            by_complex.setdefault(complex_id, []).append(key)
+            by_payment_type.setdefault(payment_type_id, []).append(key)
+        logger.info("Discount matrix loaded: %d combinations in %.1f ms (generation %d)",
+                    len(index), (time.perf_counter() - started) * 1000, generation)
+        return generation, index, values, by_complex, by_payment_type
+
+
+discount_cache = DiscountMatrixCache()
@@ -0,0 +1,96 @@
+import logging
+from datetime import datetime
+from typing import Optional, List, Dict, Any, Tuple
+from models import db, DiscountHistory
+
+logger = logging.getLogger(__name__)
+
+HISTORY_COLUMNS = ('mpp_discount', 'opt_discount', 'kd_discount')
+
+
+def record_batch(diff: List[Dict[str, Any]], import_batch_id: Optional[int], valid_from: datetime,
+                 batch_size: int = 1000) -> int:
+    """
+    Append the versions introduced by an import batch, in the caller's transaction.
+
+    :param diff: SyncReport.diff; removed combinations carry None discounts
+    :param import_batch_id: Id of the ImportBatch the versions belong to
+    :param valid_from: Time the versions take effect
+    :param batch_size: Rows per multi-row insert
+    :return: Number of versions written
+    """
+    # A combination repeated within one sync produces several diff entries; the last one is stored
+    latest: Dict[Tuple[int, int, int], Dict[str, Any]] = {}
+    for item in diff:
+        latest[(item['complex_id'], item['type_id'], item['payment_type_id'])] = item
+    rows = [
+        {
+            'complex_id': complex_id,
+            'type_id': type_id,
+            'payment_type_id': payment_type_id,
+            'mpp_discount': item['mpp_discount'],
+            'opt_discount': item['opt_discount'],
+            'kd_discount': item['kd_discount'],
+            'valid_from': valid_from,
+            'import_batch_id': import_batch_id,
+        }
+        for (complex_id, type_id, payment_type_id), item in latest.items()
+    ]
+    for start in range(0, len(rows), batch_size):
+        db.session.execute(db.insert(DiscountHistory), rows[start:start + batch_size])
+    return len(rows)
+
+
+def combination_history(complex_id: int, type_id: int, payment_type_id: int) -> List[DiscountHistory]:
+    """Every stored version of one combination, oldest first."""
+    return db.session.execute(
+        db.select(DiscountHistory)
+        .where(DiscountHistory.complex_id == complex_id,
+               DiscountHistory.type_id == type_id,
+               DiscountHistory.payment_type_id == payment_type_id)
+        .order_by(DiscountHistory.valid_from, DiscountHistory.id)
+    ).scalars().all()
+
+
+def as_of(at: datetime, complex_id: Optional[int] = None, type_id: Optional[int] = None,
+          payment_type_id: Optional[int] = None) -> List[DiscountHistory]:
+    """
+    The discount matrix as it was at a point in time.
+
+    Picks the newest version at or before `at` of every combination matching the
+    given ids, using the (combination, valid_from) index, and drops combinations
+    whose newest version is a removal. Versions sharing a valid_from, as two imports
+    within one second do at DATETIME precision, are ordered by id.
+
+    :param at: Point in time
+    :return: DiscountHistory rows, one per combination that existed at `at`
+    """
+    filters = [DiscountHistory.valid_from <= at]
+    if complex_id is not None:
+        filters.append(DiscountHistory.complex_id == complex_id)
+    if type_id is not None:
+        filters.append(DiscountHistory.type_id == type_id)
+    if payment_type_id is not None:
+        filters.append(DiscountHistory.payment_type_id == payment_type_id)
+    newest = (
+        db.select(DiscountHistory.complex_id, DiscountHistory.type_id, DiscountHistory.payment_type_id,
+                  db.func.max(DiscountHistory.valid_from).label('valid_from'))
+        .where(*filters)
+        .group_by(DiscountHistory.complex_id, DiscountHistory.type_id, DiscountHistory.payment_type_id)
+        .subquery()
+    )
+    latest = (
+        db.select(db.func.max(DiscountHistory.id).label('id'))
+        .join(newest, db.and_(DiscountHistory.complex_id == newest.c.complex_id,
+                              DiscountHistory.type_id == newest.c.type_id,
+                              DiscountHistory.payment_type_id == newest.c.payment_type_id,
+                              DiscountHistory.valid_from == newest.c.valid_from))
+        .group_by(DiscountHistory.complex_id, DiscountHistory.type_id, DiscountHistory.payment_type_id)
+        .subquery()
+    )
+    return db.session.execute(
+        db.select(DiscountHistory)
+        .join(latest, DiscountHistory.id == latest.c.id)
+        .where(DiscountHistory.mpp_discount.is_not(None))
+        .order_by(DiscountHistory.complex_id, DiscountHistory.type_id, DiscountHistory.payment_type_id)
+    ).scalars().all()
@@ -0,0 +1,50 @@
+import os
+import glob
+import socket
+import multiprocessing
+
+# Gunicorn settings, all overridable from the environment.
+# Reload code and config without dropping connections with: kill -HUP <master pid>
+
+bind = os.getenv('GUNICORN_BIND', f"0.0.0.0:{os.getenv('PORT', '80')}")
+workers = int(os.getenv('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+worker_class = os.getenv('GUNICORN_WORKER_CLASS', 'gthread')
+# Each dashboard waiting for live updates holds one of these threads; updates.py admits
+# UPDATES_MAX_CLIENTS (default 1) per worker and makes the other dashboards poll
+threads = int(os.getenv('GUNICORN_THREADS', 4))
+keepalive = int(os.getenv('GUNICORN_KEEPALIVE', 5))
+timeout = int(os.getenv('GUNICORN_TIMEOUT', 60))
+graceful_timeout = int(os.getenv('GUNICORN_GRACEFUL_TIMEOUT', 30))
+
+# Recycle workers periodically so slow leaks cannot build up
+max_requests = int(os.getenv('GUNICORN_MAX_REQUESTS', 5000))
+max_requests_jitter = int(os.getenv('GUNICORN_MAX_REQUESTS_JITTER', 500))
+
+# Each worker builds its own app: background import threads must start after the fork
+preload_app = False
+
+accesslog = os.getenv('GUNICORN_ACCESS_LOG') or None
+errorlog = '-'
+loglevel = os.getenv('GUNICORN_LOG_LEVEL', 'info')
+
+# Workers write Prometheus samples here so /metrics can aggregate across processes
+os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR', '/tmp/prometheus-multiproc')
+
+
+def _process_prefix():
+    # Same naming as metrics.process_identifier(); not imported so the master stays light
+    return (os.getenv('METRICS_PROCESS_PREFIX') or socket.gethostname()).replace('_', '-')
+
+
+def on_starting(server):
+    # Samples of a previous master would otherwise be summed into the new ones. The
+    # directory may be shared with the import worker container: only remove our files.
+    path = os.environ['PROMETHEUS_MULTIPROC_DIR']
+    os.makedirs(path, exist_ok=True)
+    for name in glob.glob(os.path.join(path, f"*_{_process_prefix()}-*.db")):
+        os.remove(name)
+
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(f"{_process_prefix()}-{worker.pid}")
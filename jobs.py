@@ -0,0 +1,288 @@
+import os
+import json
+import time
+import uuid
+import sqlite3
+import logging
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Optional, Dict, Any, List
+from sheet_schema import ALL_SHEETS  # noqa: F401 (re-exported for older imports)
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS import_job (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    state TEXT NOT NULL DEFAULT 'queued',
+    filename TEXT NOT NULL,
+    path TEXT NOT NULL,
+    sheet_name TEXT,
+    rows_processed INTEGER NOT NULL DEFAULT 0,
+    inserted INTEGER NOT NULL DEFAULT 0,
+    updated INTEGER NOT NULL DEFAULT 0,
+    skipped INTEGER NOT NULL DEFAULT 0,
+    errors TEXT NOT NULL DEFAULT '[]',
+    created_at REAL NOT NULL,
+    started_at REAL,
+    updated_at REAL,
+    finished_at REAL
+)
+"""
+
+
+class ImportJobQueue:
+    """
+    Queue of Excel imports processed outside the HTTP request.
+
+    Jobs live in a SQLite file on the instance volume, so any worker process of the
+    container can pick them up and report on them, one job at a time. Each serving process starts
+    IMPORT_WORKERS background threads on its first request; with IMPORT_WORKERS=0
+    jobs are left to a separate `python jobs.py` process.
+    """
+
+    def __init__(self):
+        self.app = None
+        self.db_path = None
+        self.upload_dir = None
+        self.poll_interval = 2.0
+        self.stale_after = 600.0
+        self.heartbeat_interval = 15.0
+        self.workers = 1
+        self._wakeup = threading.Event()
+        self._threads = []
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.app = app
+        self.db_path = os.path.join(app.instance_path, 'import_jobs.sqlite3')
+        self.upload_dir = os.path.join(app.instance_path, 'uploads')
+        self.poll_interval = float(os.getenv('IMPORT_POLL_INTERVAL', self.poll_interval))
+        self.stale_after = float(os.getenv('IMPORT_JOB_STALE_SECONDS', self.stale_after))
+        # Well inside stale_after, so only a dead or hung worker ever looks stale
+        self.heartbeat_interval = min(float(os.getenv('IMPORT_HEARTBEAT_SECONDS', self.heartbeat_interval)),
+                                      self.stale_after / 4)
+        self.workers = int(os.getenv('IMPORT_WORKERS', self.workers))
+        os.makedirs(self.upload_dir, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute(SCHEMA)
+        app.extensions['import_jobs'] = self
+        # Started lazily so CLI commands such as init-db never pick up jobs
+        app.before_request(self.start)
+
+    def start(self):
+        """Start the background threads that process queued jobs, once per process."""
+        if len(self._threads) >= self.workers:
+            return
+        with self._lock:
+            for _ in range(self.workers - len(self._threads)):
+                thread = threading.Thread(target=self.run_forever, name='import-worker', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def enqueue(self, file_object, sheet_name: Optional[str] = None) -> int:
+        """
+        Save an uploaded workbook to the instance volume and queue it for import.
+
+        :param file_object: Uploaded file (werkzeug FileStorage)
+        :param sheet_name: Optional name of the sheet to read
+        :return: Job id
+        """
+        filename = getattr(file_object, 'filename', None) or 'upload.xlsx'
+        extension = os.path.splitext(filename)[1].lower() or '.xlsx'
+        path = os.path.join(self.upload_dir, f"{uuid.uuid4().hex}{extension}")
+        file_object.save(path)
+        with self._connect() as conn:
+            job_id = conn.execute(
+                'INSERT INTO import_job (filename, path, sheet_name, created_at) VALUES (?, ?, ?, ?)',
+                (filename, path, sheet_name, time.time())
+            ).lastrowid
+        self._wakeup.set()
+        logger.info("Queued import job %d for %s", job_id, filename)
+        return job_id
+
+    def get(self, job_id: int) -> Optional[Dict[str, Any]]:
+        """
+        Describe a job for the progress API.
+
+        :param job_id: Job id returned by enqueue
+        :return: Job state dictionary or None if the job does not exist
+        """
+        with self._connect() as conn:
+            row = conn.execute('SELECT * FROM import_job WHERE id = ?', (job_id,)).fetchone()
+        if row is None:
+            return None
+        started, finished = row['started_at'], row['finished_at']
+        elapsed = ((finished or time.time()) - started) if started else 0.0
+        return {
+            'id': row['id'],
+            'state': row['state'],
+            'filename': row['filename'],
+            'rows_processed': row['rows_processed'],
+            'rows_per_second': round(row['rows_processed'] / elapsed, 1) if elapsed > 0 else 0.0,
+            'elapsed': round(elapsed, 2),
+            'inserted': row['inserted'],
+            'updated': row['updated'],
+            'skipped': row['skipped'],
+            'errors': json.loads(row['errors']),
+            'created_at': self._isoformat(row['created_at']),
+            'started_at': self._isoformat(started),
+            'finished_at': self._isoformat(finished),
+        }
+
+    def run_forever(self):
+        """Process jobs until the process exits."""
+        while True:
+            try:
+                job = self._claim()
+            except sqlite3.Error as e:
+                logger.error(f"Could not claim import job: {e}")
+                job = None
+            if job is None:
+                self._wakeup.wait(self.poll_interval)
+                self._wakeup.clear()
+                continue
+            self._run(job)
+
+    def _claim(self) -> Optional[sqlite3.Row]:
+        """
+        Atomically move the oldest queued job to the running state.
+
+        Nothing is claimed while another job runs: imports of every process write the
+        same tables, each from its own snapshot of the existing rows, so they must not
+        overlap.
+        """
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            # A job whose worker stopped reporting progress is not coming back
+            stale = conn.execute(
+                "UPDATE import_job SET state = 'failed', finished_at = ?, "
+                "errors = json_array('Import worker stopped responding') "
+                "WHERE state = 'running' AND updated_at < ? RETURNING path",
+                (now, now - self.stale_after)
+            ).fetchall()
+            job = conn.execute(
+                "UPDATE import_job SET state = 'running', started_at = ?, updated_at = ? "
+                "WHERE id = (SELECT id FROM import_job WHERE state = 'queued' ORDER BY id LIMIT 1) "
+                "AND NOT EXISTS (SELECT 1 FROM import_job WHERE state = 'running') "
+                "RETURNING *",
+                (now, now)
+            ).fetchone()
+            conn.execute('COMMIT')
+        for row in stale:
+            self._remove_upload(row['path'])
+        return job
+
+    def _run(self, job: sqlite3.Row):
+        # Imported here: services pulls in the Excel stack, which the queue itself does not need
+        from services import DataSyncService
+        from models import db
+
+        def progress(rows: int):
+            self._update(job['id'], rows_processed=rows, updated_at=time.time())
+
+        logger.info("Running import job %d (%s)", job['id'], job['filename'])
+        with self.app.app_context(), self._heartbeat(job['id']):
+            try:
+                with open(job['path'], 'rb') as file_object:
+                    report = DataSyncService(progress=progress).sync_from_upload(file_object, job['sheet_name'])
+            except Exception as e:
+                db.session.rollback()
+                logger.error(f"Import job {job['id']} failed: {e}")
+                self._update(job['id'], state='failed', finished_at=time.time(), errors=json.dumps([str(e)], ensure_ascii=False))
+                self._remove_upload(job['path'])
+                return
+        finished = self._update(
+            job['id'],
+            state='done',
+            finished_at=time.time(),
+            rows_processed=report.processed,
+            inserted=report.inserted,
+            updated=report.updated,
+            skipped=report.skipped,
+            errors=json.dumps(self._errors(report), ensure_ascii=False),
+        )
+        self._remove_upload(job['path'])
+        if not finished:
+            logger.error("Import job %d finished after it had been marked failed: %s", job['id'], report)
+            return
+        logger.info("Import job %d done: %s", job['id'], report)
+
+    @contextmanager
+    def _heartbeat(self, job_id: int):
+        """
+        Refresh a running job's updated_at every heartbeat_interval.
+
+        Progress callbacks alone are too sparse: a small or .xls file is read in one go,
+        and a multi-sheet import reports once per sheet.
+        """
+        stop = threading.Event()
+
+        def beat():
+            while not stop.wait(self.heartbeat_interval):
+                try:
+                    self._update(job_id, updated_at=time.time())
+                except sqlite3.Error as e:
+                    logger.warning(f"Could not record heartbeat of import job {job_id}: {e}")
+
+        thread = threading.Thread(target=beat, name='import-heartbeat', daemon=True)
+        thread.start()
+        try:
+            yield
+        finally:
+            stop.set()
+            thread.join()
+
+    @staticmethod
+    def _remove_upload(path: str):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    @staticmethod
+    def _errors(report) -> List[str]:
+        """Unreadable sheets first, then rejected rows, prefixed with their sheet on multi-sheet imports."""
+        errors = [f"{item['sheet']}: {item['error']}" for item in report.sheet_errors]
+        for item in report.rejected:
+            prefix = f"{item['sheet']}, row" if 'sheet' in item else "Row"
+            errors.append(f"{prefix} {item['row']}: {item['reason']}")
+        return errors
+
+    def _update(self, job_id: int, **fields) -> bool:
+        """
+        Update a running job.
+
+        :return: False if the job is no longer running, e.g. marked failed as stale
+        """
+        assignments = ', '.join(f"{name} = ?" for name in fields)
+        with self._connect() as conn:
+            return conn.execute(f"UPDATE import_job SET {assignments} WHERE id = ? AND state = 'running'",
+                                (*fields.values(), job_id)).rowcount > 0
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _isoformat(timestamp: Optional[float]) -> Optional[str]:
+        return datetime.fromtimestamp(timestamp).isoformat(timespec='seconds') if timestamp else None
+
+
+import_jobs = ImportJobQueue()
+
+
+if __name__ == '__main__':
+    # Standalone import worker for deployments that run the web processes with IMPORT_WORKERS=0
+    import metrics
+    from app import create_app
+    metrics.remove_process_files()
+    create_app().extensions['import_jobs'].run_forever()
@@ -0,0 +1,167 @@
+import os
+import sys
+import json
+import atexit
+import time
+import queue
+import random
+import logging
+import logging.handlers
+import click
+from flask import g, request
+
+logger = logging.getLogger(__name__)
+
+# Attributes every LogRecord has; anything else was passed through `extra`
+_RECORD_ATTRS = set(vars(logging.makeLogRecord({}))) | {'message', 'asctime', 'taskName'}
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line with the standard fields plus any `extra` values."""
+
+    def format(self, record):
+        entry = {
+            'ts': self.formatTime(record, '%Y-%m-%dT%H:%M:%S'),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRS:
+                entry[key] = value
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """Keep a fraction of the records below WARNING; warnings and errors always pass."""
+
+    def __init__(self, rate: float):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        return record.levelno >= logging.WARNING or self.rate >= 1.0 or random.random() < self.rate
+
+
+class RuntimeLogLevel:
+    """
+    Root log level switchable without a redeploy.
+
+    The level is written to a file on the instance volume (see the `log-level` CLI
+    command); every worker checks the file's mtime at most every `check_interval`
+    seconds and applies a new level.
+    """
+
+    def __init__(self, default_level: str = 'INFO', check_interval: float = 5.0):
+        self.default_level = default_level
+        self.check_interval = check_interval
+        self.path = None
+        self._mtime = None
+        self._checked_at = 0.0
+
+    def init_app(self, app):
+        os.makedirs(app.instance_path, exist_ok=True)
+        self.path = os.path.join(app.instance_path, 'log_level')
+        app.before_request(self.refresh)
+
+    def set(self, level: str):
+        """Publish a new level to every worker."""
+        level = level.upper()
+        if not isinstance(logging.getLevelName(level), int):
+            raise ValueError(f"Unknown log level: {level}")
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as f:
+            f.write(level)
+        os.replace(tmp_path, self.path)
+        self.refresh(force=True)
+
+    def refresh(self, force: bool = False):
+        now = time.monotonic()
+        if not force and now - self._checked_at < self.check_interval:
+            return
+        self._checked_at = now
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except OSError:
+            mtime = None
+        if mtime == self._mtime:
+            return
+        self._mtime = mtime
+        level = self.default_level
+        if mtime is not None:
+            with open(self.path) as f:
+                level = f.read().strip().upper() or self.default_level
+        logging.getLogger().setLevel(level)
+        logger.info("Log level set to %s", level)
+
+
+runtime_log_level = RuntimeLogLevel()
+
+
+def configure_logging(app):
+    """
+    Route all logging through a queue to one background writer and install the
+    runtime level switch and sampled request logging on the app.
+
+    Environment:
+        LOG_LEVEL - initial root level (INFO)
+        LOG_FORMAT - 'json' (default) or 'text'
+        LOG_SAMPLE_RATE - fraction of DEBUG/INFO records kept (1.0)
+        LOG_REQUEST_SAMPLE_RATE - fraction of requests logged with status and duration (0.0)
+    """
+    level = os.getenv('LOG_LEVEL', 'INFO').upper()
+    root = logging.getLogger()
+    # A second app in the same process reuses the handlers of the first
+    if not any(isinstance(handler, logging.handlers.QueueHandler) for handler in root.handlers):
+        output = logging.StreamHandler(sys.stdout)
+        if os.getenv('LOG_FORMAT', 'json').lower() == 'json':
+            output.setFormatter(JsonFormatter())
+        else:
+            output.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(name)s: %(message)s'))
+
+        # Request threads only enqueue records; the listener thread does the blocking I/O
+        log_queue = queue.SimpleQueue()
+        queue_handler = logging.handlers.QueueHandler(log_queue)
+        queue_handler.addFilter(SamplingFilter(float(os.getenv('LOG_SAMPLE_RATE', 1.0))))
+        listener = logging.handlers.QueueListener(log_queue, output)
+        listener.start()
+        atexit.register(listener.stop)
+
+        for handler in list(root.handlers):
+            root.removeHandler(handler)
+        root.addHandler(queue_handler)
+        root.setLevel(level)
+
+    runtime_log_level.default_level = level
+    runtime_log_level.init_app(app)
+
+    request_sample_rate = float(os.getenv('LOG_REQUEST_SAMPLE_RATE', 0.0))
+    if request_sample_rate > 0:
+        request_logger = logging.getLogger('request')
+
+        @app.before_request
+        def sample_request():
+            if random.random() < request_sample_rate:
+                g.request_started = time.perf_counter()
+
+        @app.after_request
+        def log_request(response):
+            started = g.pop('request_started', None)
+            if started is not None:
+                request_logger.info('request', extra={
+                    'method': request.method,
+                    'path': request.path,
+                    'endpoint': request.endpoint,
+                    'status': response.status_code,
+                    'duration_ms': round((time.perf_counter() - started) * 1000, 2),
+                })
+            return response
+
+    @app.cli.command('log-level')
+    @click.argument('level')
+    def set_log_level(level):
+        """Switch the log level of all running workers, e.g. `flask log-level DEBUG`."""
+        runtime_log_level.set(level)
+        print(f"Log level set to {level.upper()}")
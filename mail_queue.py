@@ -0,0 +1,256 @@
+import os
+import time
+import sqlite3
+import logging
+import smtplib
+import threading
+from contextlib import contextmanager
+from email.mime.text import MIMEText
+from typing import List
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS outbound_mail (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    state TEXT NOT NULL DEFAULT 'queued',
+    recipient TEXT NOT NULL,
+    subject TEXT NOT NULL,
+    body TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    last_error TEXT,
+    created_at REAL NOT NULL,
+    next_attempt_at REAL NOT NULL,
+    claimed_at REAL,
+    sent_at REAL
+)
+"""
+INDEX = "CREATE INDEX IF NOT EXISTS ix_outbound_mail_due ON outbound_mail (state, next_attempt_at)"
+
+
+class MailQueue:
+    """
+    Outbound mail sent by a background thread instead of the calling request.
+
+    Messages wait in a SQLite file on the instance volume. The sender claims due
+    messages in batches and delivers them over one SMTP session, which stays open
+    between batches until it has been idle for MAIL_SMTP_IDLE_SECONDS. A failed
+    message is retried with exponential backoff; after MAIL_MAX_ATTEMPTS it is kept
+    in the 'dead' state until requeued with `flask mail-requeue`.
+    """
+
+    def __init__(self):
+        self.db_path = None
+        self.batch_size = 20
+        self.max_attempts = 8
+        self.retry_base = 30.0
+        self.retry_max = 3600.0
+        self.poll_interval = 5.0
+        self.idle_timeout = 60.0
+        self.stale_after = 300.0
+        self.workers = 1
+        self._local = threading.local()  # SMTP session of each sender thread
+        self._wakeup = threading.Event()
+        self._threads = []
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.db_path = os.path.join(app.instance_path, 'mail_queue.sqlite3')
+        self.batch_size = int(os.getenv('MAIL_BATCH_SIZE', self.batch_size))
+        self.max_attempts = int(os.getenv('MAIL_MAX_ATTEMPTS', self.max_attempts))
+        self.retry_base = float(os.getenv('MAIL_RETRY_BASE_SECONDS', self.retry_base))
+        self.retry_max = float(os.getenv('MAIL_RETRY_MAX_SECONDS', self.retry_max))
+        self.poll_interval = float(os.getenv('MAIL_POLL_INTERVAL', self.poll_interval))
+        self.idle_timeout = float(os.getenv('MAIL_SMTP_IDLE_SECONDS', self.idle_timeout))
+        self.workers = int(os.getenv('MAIL_WORKERS', self.workers))
+        os.makedirs(app.instance_path, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute(SCHEMA)
+            conn.execute(INDEX)
+        app.extensions['mail_queue'] = self
+        # Started lazily, like the import workers, so CLI commands never send mail
+        app.before_request(self.start)
+
+        @app.cli.command('mail-requeue')
+        def mail_requeue():
+            """Queue every dead-lettered message for another round of attempts."""
+            print(f"Requeued {self.requeue_dead()} messages")
+
+    def start(self):
+        """Start the sender threads, once per process."""
+        if len(self._threads) >= self.workers:
+            return
+        with self._lock:
+            for _ in range(self.workers - len(self._threads)):
+                thread = threading.Thread(target=self.run_forever, name='mail-sender', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def enqueue(self, recipient: str, subject: str, body: str) -> int:
+        """
+        Queue a plain-text message and return immediately.
+
+        :param recipient: Recipient address
+        :param subject: Message subject
+        :param body: Message text
+        :return: Message id
+        """
+        if self.db_path is None:
+            raise RuntimeError('MailQueue.init_app() has not been called')
+        now = time.time()
+        with self._connect() as conn:
+            message_id = conn.execute(
+                'INSERT INTO outbound_mail (recipient, subject, body, created_at, next_attempt_at) '
+                'VALUES (?, ?, ?, ?, ?)',
+                (recipient, subject, body, now, now)
+            ).lastrowid
+        self._wakeup.set()
+        return message_id
+
+    def requeue_dead(self) -> int:
+        """Give dead-lettered messages a fresh set of attempts; returns how many were requeued."""
+        with self._connect() as conn:
+            return conn.execute(
+                "UPDATE outbound_mail SET state = 'queued', attempts = 0, next_attempt_at = ? WHERE state = 'dead'",
+                (time.time(),)
+            ).rowcount
+
+    def run_forever(self):
+        """Send mail until the process exits."""
+        while True:
+            try:
+                batch = self._claim()
+            except sqlite3.Error as e:
+                logger.error(f"Could not claim outbound mail: {e}")
+                batch = []
+            if batch:
+                self.send_batch(batch)
+                continue
+            if time.monotonic() - getattr(self._local, 'used_at', 0.0) > self.idle_timeout:
+                self._close_smtp()
+            self._wakeup.wait(self.poll_interval)
+            self._wakeup.clear()
+
+    def send_batch(self, batch: List[sqlite3.Row]):
+        """Deliver claimed messages over this thread's SMTP session, recording each outcome."""
+        sender = os.getenv('SEND_FROM_EMAIL')
+        for message in batch:
+            msg = MIMEText(message['body'])
+            msg['Subject'] = message['subject']
+            msg['From'] = sender
+            msg['To'] = message['recipient']
+            try:
+                self._deliver(sender, message['recipient'], msg.as_string())
+            except (smtplib.SMTPException, OSError) as e:
+                # The session may be unusable now; the next message reconnects
+                self._close_smtp()
+                self._failed(message, e)
+                continue
+            self._local.used_at = time.monotonic()
+            with self._connect() as conn:
+                conn.execute("UPDATE outbound_mail SET state = 'sent', attempts = attempts + 1, sent_at = ? "
+                             "WHERE id = ?", (time.time(), message['id']))
+        logger.info("Processed %d outbound messages", len(batch))
+
+    def _deliver(self, sender: str, recipient: str, text: str):
+        """
+        Send one message over this thread's SMTP session.
+
+        A kept-open session the server has dropped since its last use gets one reconnect,
+        so a stale connection does not count against the message's attempts.
+        """
+        reused = getattr(self._local, 'smtp', None) is not None
+        try:
+            self._session().sendmail(sender, recipient, text)
+        except (smtplib.SMTPException, OSError) as e:
+            if not (reused and self._is_disconnect(e)):
+                raise
+            logger.info(f"SMTP session was closed by the server ({e}), reconnecting")
+            self._close_smtp()
+            self._session().sendmail(sender, recipient, text)
+
+    @staticmethod
+    def _is_disconnect(error: Exception) -> bool:
+        """Whether an error means the connection is gone rather than the message being refused."""
+        if isinstance(error, smtplib.SMTPServerDisconnected):
+            return True
+        if isinstance(error, smtplib.SMTPResponseException):
+            return error.smtp_code == 421  # Service closing transmission channel
+        # Socket errors (reset, broken pipe); smtplib's own errors are OSErrors too
+        return not isinstance(error, smtplib.SMTPException)
+
+    def _failed(self, message: sqlite3.Row, error: Exception):
+        attempts = message['attempts'] + 1
+        with self._connect() as conn:
+            if attempts >= self.max_attempts:
+                conn.execute("UPDATE outbound_mail SET state = 'dead', attempts = ?, last_error = ? WHERE id = ?",
+                             (attempts, str(error), message['id']))
+                logger.error(f"Giving up on mail {message['id']} to {message['recipient']} "
+                             f"after {attempts} attempts: {error}")
+                return
+            delay = min(self.retry_base * 2 ** (attempts - 1), self.retry_max)
+            conn.execute("UPDATE outbound_mail SET state = 'queued', attempts = ?, last_error = ?, "
+                         "next_attempt_at = ? WHERE id = ?",
+                         (attempts, str(error), time.time() + delay, message['id']))
+        logger.warning(f"Failed to send mail {message['id']}: {error}; retrying in {delay:.0f} seconds")
+
+    def _claim(self) -> List[sqlite3.Row]:
+        """Atomically move up to batch_size due messages to the sending state."""
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            # Messages claimed by a process that died go back to the queue
+            conn.execute("UPDATE outbound_mail SET state = 'queued' WHERE state = 'sending' AND claimed_at < ?",
+                         (now - self.stale_after,))
+            batch = conn.execute(
+                "SELECT * FROM outbound_mail WHERE state = 'queued' AND next_attempt_at <= ? "
+                "ORDER BY next_attempt_at LIMIT ?", (now, self.batch_size)
+            ).fetchall()
+            if batch:
+                conn.executemany("UPDATE outbound_mail SET state = 'sending', claimed_at = ? WHERE id = ?",
+                                 [(now, message['id']) for message in batch])
+            conn.execute('COMMIT')
+        return batch
+
+    def _session(self) -> smtplib.SMTP:
+        """Open SMTP session, connecting and logging in only when there is none."""
+        smtp = getattr(self._local, 'smtp', None)
+        if smtp is None:
+            smtp = smtplib.SMTP(os.getenv('EMAIL_SERVER', 'localhost'), int(os.getenv('EMAIL_SERVER_PORT', 25)),
+                                timeout=float(os.getenv('EMAIL_TIMEOUT', 30)))
+            # A local SMTP stand-in for development and tests speaks neither TLS nor AUTH
+            if os.getenv('EMAIL_STARTTLS', 'true').lower() == 'true':
+                smtp.starttls()
+            password = os.getenv('SEND_FROM_EMAIL_PASSWORD')
+            if password:
+                smtp.login(os.getenv('SEND_FROM_EMAIL'), password)
+            self._local.smtp = smtp
+        return smtp
+
+    def _close_smtp(self):
+        smtp, self._local.smtp = getattr(self._local, 'smtp', None), None
+        if smtp is None:
+            return
+        try:
+            smtp.quit()
+        except (smtplib.SMTPException, OSError):
+            smtp.close()
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+
+mail_queue = MailQueue()
+
+
+if __name__ == '__main__':
+    # Standalone sender for deployments that run the web processes with MAIL_WORKERS=0
+    from app import create_app
+    create_app().extensions['mail_queue'].run_forever()
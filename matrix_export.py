@@ -0,0 +1,197 @@
+import io
+import os
+import csv
+import glob
+import gzip
+import json
+import hashlib
+import logging
+import threading
+from typing import Dict, Tuple
+from models import db, DiscountObject, Complex, PropertyType, PaymentType
+from discount_cache import discount_cache
+from database import read_bind_arguments
+from sheet_schema import NAME_COLUMNS, DISCOUNT_COLUMNS, configured_columns
+
+logger = logging.getLogger(__name__)
+
+MATRIX_COLUMNS = ['complex_id', 'complex', 'type_id', 'type', 'payment_type_id', 'payment_type',
+                  'mpp_discount', 'opt_discount', 'kd_discount']
+
+
+class MatrixSnapshot:
+    """Serialized discount matrix of one data version in one format."""
+
+    def __init__(self, version: int, body: bytes, mimetype: str):
+        self.version = version
+        self.body = body
+        self.gzipped = gzip.compress(body, compresslevel=6)
+        self.mimetype = mimetype
+        self.etag = hashlib.sha256(body).hexdigest()[:32]
+
+
+class MatrixExportCache:
+    """
+    Full discount matrix serialized once per data version.
+
+    The snapshot is rebuilt only when the discount cache generation moves, so repeat
+    requests cost a dictionary lookup and, with a matching ETag, an empty 304.
+    """
+
+    FORMATS = {'json': 'application/json', 'csv': 'text/csv; charset=utf-8'}
+
+    def __init__(self):
+        self._snapshots: Dict[str, MatrixSnapshot] = {}
+        self._lock = threading.Lock()
+
+    def get(self, fmt: str = 'json') -> MatrixSnapshot:
+        """
+        Snapshot of the current matrix.
+
+        :param fmt: 'json' or 'csv'
+        :return: MatrixSnapshot
+        """
+        version = discount_cache.version()
+        snapshot = self._snapshots.get(fmt)
+        if snapshot is not None and snapshot.version == version:
+            return snapshot
+        with self._lock:
+            snapshot = self._snapshots.get(fmt)
+            if snapshot is None or snapshot.version != version:
+                snapshot = self._snapshots[fmt] = self._build(fmt, version)
+        return snapshot
+
+    def _build(self, fmt: str, version: int) -> MatrixSnapshot:
+        rows = db.session.execute(
+            db.select(
+                DiscountObject.complex_id, Complex.name,
+                DiscountObject.type_id, PropertyType.name,
+                DiscountObject.payment_type_id, PaymentType.name,
+                DiscountObject.mpp_discount, DiscountObject.opt_discount, DiscountObject.kd_discount,
+            )
+            .join(Complex, Complex.id == DiscountObject.complex_id)
+            .join(PropertyType, PropertyType.id == DiscountObject.type_id)
+            .join(PaymentType, PaymentType.id == DiscountObject.payment_type_id)
+            .order_by(Complex.name, PropertyType.name, PaymentType.name),
+            **read_bind_arguments(version)
+        )
+        # Same percent values as /api/discounts
+        data = [
+            [complex_id, complex_name, type_id, type_name, payment_type_id, payment_type_name,
+             round((mpp or 0) * 100, 2), round((opt or 0) * 100, 2), round((kd or 0) * 100, 2)]
+            for (complex_id, complex_name, type_id, type_name, payment_type_id, payment_type_name,
+                 mpp, opt, kd) in rows
+        ]
+        if fmt == 'csv':
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            writer.writerow(MATRIX_COLUMNS)
+            writer.writerows(data)
+            body = buffer.getvalue().encode('utf-8')
+        else:
+            body = json.dumps({'version': str(version), 'columns': MATRIX_COLUMNS, 'rows': data},
+                              ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+        logger.info("Discount matrix serialized as %s: %d rows, %d bytes", fmt, len(data), len(body))
+        return MatrixSnapshot(version, body, self.FORMATS[fmt])
+
+
+matrix_export = MatrixExportCache()
+
+
+class XlsxExportCache:
+    """
+    The discount matrix as a workbook in the import schema, one file per data version.
+
+    Files live in the instance volume, shared by every worker, and are written with
+    openpyxl in write-only mode from a server-side cursor, so building one takes
+    constant memory. A file is written under a temporary name and renamed into place;
+    files of older versions are removed once the new one exists. Newer files are left
+    alone, since a worker that has not seen the latest generation yet may build after
+    a worker that has.
+    """
+
+    def __init__(self):
+        self.directory = None
+        self.fetch_size = 2000
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.directory = os.path.join(app.instance_path, 'exports')
+        self.fetch_size = int(os.getenv('EXPORT_FETCH_SIZE', self.fetch_size))
+        os.makedirs(self.directory, exist_ok=True)
+
+    def get(self) -> Tuple[str, int]:
+        """
+        Path of the workbook for the current data version, built if needed.
+
+        :return: (path, version)
+        """
+        version = discount_cache.version()
+        path = os.path.join(self.directory, f"discounts-{version}.xlsx")
+        # Checked under the lock as well: another process may remove the file of an older
+        # version at any time, in which case it is built again
+        if not os.path.exists(path):
+            with self._lock:
+                if not os.path.exists(path):
+                    self._build(path, version)
+        return path, version
+
+    def _remove_older(self, version: int):
+        for old in glob.glob(os.path.join(self.directory, 'discounts-*.xlsx')):
+            generation = os.path.basename(old)[len('discounts-'):-len('.xlsx')]
+            if not generation.isdigit() or int(generation) >= version:
+                continue
+            try:
+                os.remove(old)
+            except FileNotFoundError:
+                pass  # Removed by another worker
+
+    def _build(self, path: str, version: int):
+        # Imported here: the Excel stack stays out of processes that never export
+        from openpyxl import Workbook
+        from openpyxl.cell import WriteOnlyCell
+
+        sources = {
+            'complex': Complex.name, 'property_type': PropertyType.name, 'payment_type': PaymentType.name,
+            'mpp_discount': DiscountObject.mpp_discount, 'opt_discount': DiscountObject.opt_discount,
+            'kd_discount': DiscountObject.kd_discount,
+        }
+        fields = {**NAME_COLUMNS, **DISCOUNT_COLUMNS}
+        columns = configured_columns() or list(fields)
+        unknown = [column for column in columns if column not in fields]
+        if unknown:
+            raise ValueError(f"EXCEL_COLUMNS has columns the export cannot fill: {', '.join(unknown)}")
+        discount_positions = [position for position, column in enumerate(columns) if column in DISCOUNT_COLUMNS]
+
+        workbook = Workbook(write_only=True)
+        sheet = workbook.create_sheet(os.getenv('EXCEL_SHEET_NAME') or 'Sheet1')
+        sheet.append(columns)
+        rows = db.session.execute(
+            db.select(*(sources[fields[column]] for column in columns))
+            .join(Complex, Complex.id == DiscountObject.complex_id)
+            .join(PropertyType, PropertyType.id == DiscountObject.type_id)
+            .join(PaymentType, PaymentType.id == DiscountObject.payment_type_id)
+            .order_by(Complex.name, PropertyType.name, PaymentType.name),
+            execution_options={'yield_per': self.fetch_size},
+            **read_bind_arguments(version)
+        )
+        count = 0
+        for row in rows:
+            values = list(row)
+            for position in discount_positions:
+                # Stored as fractions, shown as percents: the importer reads the cell value back as is
+                cell = WriteOnlyCell(sheet, value=values[position] or 0.0)
+                cell.number_format = '0.00%'
+                values[position] = cell
+            sheet.append(values)
+            count += 1
+
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        workbook.save(tmp_path)
+        size = os.path.getsize(tmp_path)
+        os.replace(tmp_path, path)
+        self._remove_older(version)
+        logger.info("Discount workbook exported: %d rows, %d bytes (generation %d)", count, size, version)
+
+
+xlsx_export = XlsxExportCache()
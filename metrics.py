@@ -0,0 +1,121 @@
+import os
+import glob
+import time
+import socket
+from flask import Response, g, has_request_context, request
+from prometheus_client import (CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram,
+                               REGISTRY, generate_latest, multiprocess, values)
+from sqlalchemy import event
+
+# With PROMETHEUS_MULTIPROC_DIR set (see gunicorn.conf.py) every worker writes its
+# samples to memory-mapped files there and /metrics sums them across workers.
+# The import worker container shares the directory, so its sync metrics show up too.
+
+# Containers sharing the directory have overlapping pids: sample files are named
+# <prefix>-<pid>, the prefix naming the container (gunicorn.conf.py uses the same scheme)
+PROCESS_PREFIX = (os.getenv('METRICS_PROCESS_PREFIX') or socket.gethostname()).replace('_', '-')
+
+
+def process_identifier(pid=None) -> str:
+    return f"{PROCESS_PREFIX}-{pid or os.getpid()}"
+
+
+def remove_process_files():
+    """Delete the sample files earlier processes of this container left behind."""
+    path = os.getenv('PROMETHEUS_MULTIPROC_DIR')
+    if not path:
+        return
+    own = f"_{process_identifier()}.db"
+    for name in glob.glob(os.path.join(path, f"*_{PROCESS_PREFIX}-*.db")):
+        if not name.endswith(own):  # Already open for this process's samples
+            os.remove(name)
+
+
+if os.getenv('PROMETHEUS_MULTIPROC_DIR'):
+    values.ValueClass = values.MultiProcessValue(process_identifier)
+
+REQUEST_LATENCY = Histogram(
+    'http_request_duration_seconds', 'Request latency by route',
+    ['endpoint', 'method', 'status'],
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0),
+)
+DB_QUERIES = Counter('db_queries_total', 'SQL statements executed, by route', ['endpoint'])
+DB_QUERY_TIME = Counter('db_query_seconds_total', 'Time spent in SQL statements, by route', ['endpoint'])
+DB_QUERIES_PER_REQUEST = Histogram(
+    'db_queries_per_request', 'SQL statements per request', ['endpoint'],
+    buckets=(0, 1, 2, 3, 5, 10, 25, 50, 100),
+)
+DB_POOL_CHECKOUT = Histogram(
+    'db_pool_checkout_seconds', 'Time spent waiting for a pooled connection, including pre-ping', ['bind'],
+    buckets=(0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0),
+)
+DISCOUNT_CACHE_LOOKUPS = Counter(
+    'discount_cache_lookups_total', 'Discount cache lookups; result is hit or reload', ['result'],
+)
+SYNC_DURATION = Histogram(
+    'sync_duration_seconds', 'Duration of discount syncs',
+    buckets=(0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0),
+)
+SYNC_ROWS = Counter('sync_rows_total', 'Sheet rows processed by discount syncs')
+SYNC_ROWS_PER_SECOND = Gauge(
+    'sync_rows_per_second', 'Throughput of the most recent discount sync', multiprocess_mode='mostrecent',
+)
+
+
+def observe_sync(report):
+    """Record a finished DataSyncService run."""
+    SYNC_DURATION.observe(report.elapsed)
+    SYNC_ROWS.inc(report.processed)
+    if report.elapsed > 0:
+        SYNC_ROWS_PER_SECOND.set(report.processed / report.elapsed)
+
+
+def _endpoint() -> str:
+    if has_request_context():
+        return request.endpoint or 'unmatched'
+    return 'background'
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    # Kept on the execution context, which is dropped with a failed statement
+    context._query_start = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - context._query_start
+    endpoint = _endpoint()
+    DB_QUERIES.labels(endpoint).inc()
+    DB_QUERY_TIME.labels(endpoint).inc(elapsed)
+    if has_request_context():
+        g.db_queries = g.get('db_queries', 0) + 1
+
+
+def init_app(app, db):
+    """Install the request timers, the SQLAlchemy hooks and the /metrics endpoint."""
+    with app.app_context():
+        for engine in db.engines.values():
+            event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+            event.listen(engine, 'after_cursor_execute', _after_cursor_execute)
+
+    @app.before_request
+    def start_request_timer():
+        g.metrics_started = time.perf_counter()
+
+    @app.after_request
+    def observe_request(response):
+        started = g.get('metrics_started')
+        if started is not None and request.endpoint != 'metrics':
+            endpoint = request.endpoint or 'unmatched'
+            REQUEST_LATENCY.labels(endpoint, request.method, response.status_code).observe(
+                time.perf_counter() - started)
+            DB_QUERIES_PER_REQUEST.labels(endpoint).observe(g.get('db_queries', 0))
+        return response
+
+    @app.route('/metrics')
+    def metrics():
+        if os.getenv('PROMETHEUS_MULTIPROC_DIR'):
+            registry = CollectorRegistry()
+            multiprocess.MultiProcessCollector(registry)
+        else:
+            registry = REGISTRY
+        return Response(generate_latest(registry), mimetype=CONTENT_TYPE_LATEST)
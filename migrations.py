@@ -0,0 +1,159 @@
+import logging
+from datetime import datetime
+from typing import Callable, List, Tuple
+from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table, inspect, text
+from models import db, DiscountObject, DiscountHistory, Complex, PropertyType, PaymentType, ImportBatch, User
+
+logger = logging.getLogger(__name__)
+
+# Kept out of db.metadata so that the models never create or drop it
+schema_metadata = MetaData()
+schema_version = Table(
+    'schema_version', schema_metadata,
+    Column('version', Integer, primary_key=True, autoincrement=False),
+    Column('description', String(200), nullable=False),
+    Column('applied_at', DateTime, nullable=False),
+)
+
+
+def _create_tables(conn):
+    """Create the tables of the models that do not exist yet."""
+    db.metadata.create_all(bind=conn)
+
+
+def _dedupe_names(conn, model):
+    """
+    Merge rows sharing a name into the oldest one and repoint discounts at it.
+
+    Grouping and comparison happen in the database, so "duplicate" follows the same
+    collation as the unique index created afterwards.
+    """
+    table = model.__table__
+    column = {'complex': 'complex_id', 'property_type': 'type_id', 'payment_type': 'payment_type_id'}[table.name]
+    duplicated = conn.execute(text(
+        f"SELECT MIN(id), name FROM {table.name} GROUP BY name HAVING COUNT(*) > 1"
+    )).all()
+    for keep_id, name in duplicated:
+        ids = [row[0] for row in conn.execute(
+            text(f"SELECT id FROM {table.name} WHERE name = :name AND id <> :keep_id"),
+            {'name': name, 'keep_id': keep_id}
+        )]
+        for duplicate_id in ids:
+            conn.execute(text(f"UPDATE discount_object SET {column} = :keep_id WHERE {column} = :duplicate_id"),
+                         {'keep_id': keep_id, 'duplicate_id': duplicate_id})
+            conn.execute(text(f"DELETE FROM {table.name} WHERE id = :duplicate_id"), {'duplicate_id': duplicate_id})
+        logger.warning("Merged %d duplicate %s rows named %r into id %d", len(ids), table.name, name, keep_id)
+
+
+def _dedupe_discounts(conn):
+    """Keep the oldest row of every (complex, type, payment type) combination."""
+    # The derived table lets MySQL delete from the table the subquery reads
+    deleted = conn.execute(text(
+        "DELETE FROM discount_object WHERE id NOT IN ("
+        " SELECT id FROM (SELECT MIN(id) AS id FROM discount_object"
+        " GROUP BY complex_id, type_id, payment_type_id) AS keep)"
+    )).rowcount
+    if deleted:
+        logger.warning("Removed %d duplicate discount_object rows", deleted)
+
+
+def _create_indexes(conn, model):
+    """Create the indexes declared on a model that are missing from the database."""
+    existing = {index['name'] for index in inspect(conn).get_indexes(model.__tablename__)}
+    for index in model.__table__.indexes:
+        if index.name not in existing:
+            index.create(bind=conn)
+            logger.info("Created index %s", index.name)
+
+
+def _unique_lookup_indexes(conn):
+    """Unique names and one row per discount combination, backed by indexes."""
+    for model in (Complex, PropertyType, PaymentType):
+        _dedupe_names(conn, model)
+    # Merging names can make discount combinations collide, so dedupe them last
+    _dedupe_discounts(conn)
+    for model in (Complex, PropertyType, PaymentType, DiscountObject):
+        _create_indexes(conn, model)
+
+
+def _discount_history(conn):
+    """Create the history table and seed it with the current matrix as its first version."""
+    DiscountHistory.__table__.create(bind=conn, checkfirst=True)
+    if conn.execute(text("SELECT COUNT(*) FROM discount_history")).scalar():
+        return
+    seeded = conn.execute(text(
+        "INSERT INTO discount_history (complex_id, type_id, payment_type_id,"
+        " mpp_discount, opt_discount, kd_discount, valid_from)"
+        " SELECT complex_id, type_id, payment_type_id,"
+        " COALESCE(mpp_discount, 0), COALESCE(opt_discount, 0), COALESCE(kd_discount, 0), :now"
+        " FROM discount_object"
+    ), {'now': datetime.now()}).rowcount
+    logger.info("Seeded discount history with %d current discounts", seeded)
+
+
+def _add_columns(conn, model, *names):
+    """Add model columns missing from an existing table."""
+    existing = {column['name'] for column in inspect(conn).get_columns(model.__tablename__)}
+    for name in names:
+        if name in existing:
+            continue
+        column = model.__table__.c[name]
+        conn.execute(text(f"ALTER TABLE {model.__tablename__} ADD COLUMN {name} "
+                          f"{column.type.compile(dialect=conn.dialect)}"))
+
+
+def _import_batch_source(conn):
+    """Source and watermark of SQLite imports."""
+    _add_columns(conn, ImportBatch, 'source', 'watermark')
+
+
+def _null_empty_emails(conn):
+    """Store unknown emails as NULL: '' collides on the unique index from the second user on."""
+    table = User.__table__
+    cleared = conn.execute(table.update().where(table.c.email == '').values(email=None)).rowcount
+    if cleared:
+        logger.info("Cleared %d empty user emails", cleared)
+
+
+# Append only: a deployed version number must never change meaning
+MIGRATIONS: List[Tuple[int, str, Callable]] = [
+    (1, 'Create tables', _create_tables),
+    (2, 'Unique discount combination and name indexes', _unique_lookup_indexes),
+    (3, 'Discount history', _discount_history),
+    (4, 'Import batch source and watermark', _import_batch_source),
+    (5, 'NULL instead of empty user emails', _null_empty_emails),
+]
+
+
+def current_version() -> int:
+    """Latest schema version applied to the database, 0 for a database never migrated."""
+    with db.engine.connect() as conn:
+        if not inspect(conn).has_table(schema_version.name):
+            return 0
+        return conn.execute(db.select(db.func.max(schema_version.c.version))).scalar() or 0
+
+
+def upgrade() -> List[int]:
+    """
+    Apply pending migrations, each in its own transaction.
+
+    Must run inside an application context.
+
+    :return: Versions applied by this call
+    """
+    schema_metadata.create_all(bind=db.engine)
+    applied = []
+    version = current_version()
+    for number, description, migrate in MIGRATIONS:
+        if number <= version:
+            continue
+        with db.engine.begin() as conn:
+            logger.info("Applying schema migration %d: %s", number, description)
+            migrate(conn)
+            conn.execute(schema_version.insert().values(
+                version=number, description=description, applied_at=datetime.now()
+            ))
+        applied.append(number)
+    if not applied:
+        logger.info("Database schema is up to date (version %d)", version)
+    return applied
@@ -6,7 +6,8 @@ db = SQLAlchemy()
 class User(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     login = db.Column(db.String(80), unique=True, nullable=False)
-    email = db.Column(db.String(120), unique=True, default='')
+    # NULL when unknown: unique indexes let any number of NULLs coexist, unlike ''
+    email = db.Column(db.String(120), unique=True, nullable=True)
     full_name = db.Column(db.String(120), nullable=False)
     role = db.Column(db.String(50), nullable=False, default='user')
     def __repr__(self):
@@ -20,22 +21,29 @@ class DiscountObject(db.Model):
     complex_id = db.Column(db.Integer, db.ForeignKey('complex.id'), nullable=False)
     type_id = db.Column(db.Integer, db.ForeignKey('property_type.id'), nullable=False)
     payment_type_id = db.Column(db.Integer, db.ForeignKey('payment_type.id'), nullable=False)
+    # Every lookup and every sync filters on the full combination; also serves complex_id prefix lookups
+    __table_args__ = (
+        db.Index('uq_discount_object_combination', 'complex_id', 'type_id', 'payment_type_id', unique=True),
+    )
     
 class Complex(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(120), nullable=False)
+    __table_args__ = (db.Index('uq_complex_name', 'name', unique=True),)
     def __repr__(self):
         return f'<Complex {self.name}>'
     
 class PropertyType(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(120), nullable=False)
+    __table_args__ = (db.Index('uq_property_type_name', 'name', unique=True),)
     def __repr__(self):
         return f'<PropType {self.name}>'
     
 class PaymentType(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(120), nullable=False)
+    __table_args__ = (db.Index('uq_payment_type_name', 'name', unique=True),)
     def __repr__(self):
         return f'<PayType {self.name}>'
 
@@ -43,3 +51,45 @@ class Comment(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     text = db.Column(db.String(2000), nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.now)
+    format = db.relationship('CommentFormat', uselist=False, lazy='joined')
+
+class CommentFormat(db.Model):
+    """Display form of a Comment, parsed once when the comment is saved."""
+    comment_id = db.Column(db.Integer, db.ForeignKey('comment.id'), primary_key=True)
+    formatted_text = db.Column(db.Text, nullable=False)
+    structure = db.Column(db.Text, nullable=False)  # JSON: sections with per-project entries
+
+class ImportBatch(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    fingerprint = db.Column(db.String(64), index=True)
+    created_at = db.Column(db.DateTime, default=datetime.now)
+    added = db.Column(db.Integer, default=0)
+    changed = db.Column(db.Integer, default=0)
+    removed = db.Column(db.Integer, default=0)
+    unchanged = db.Column(db.Integer, default=0)
+    # Set for syncs from a SQLite source: where the rows came from and the last watermark read (JSON)
+    source = db.Column(db.String(255))
+    watermark = db.Column(db.String(64))
+    def __repr__(self):
+        return f'<ImportBatch {self.id} {self.fingerprint}>'
+
+class DiscountHistory(db.Model):
+    """
+    Append-only log of discount versions.
+
+    One row per combination added, changed or removed by an import batch; a version is
+    valid from valid_from until the next row of the same combination.
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    complex_id = db.Column(db.Integer, nullable=False)
+    type_id = db.Column(db.Integer, nullable=False)
+    payment_type_id = db.Column(db.Integer, nullable=False)
+    # NULL discounts mark a combination removed from the matrix
+    mpp_discount = db.Column(db.Float)
+    opt_discount = db.Column(db.Float)
+    kd_discount = db.Column(db.Float)
+    valid_from = db.Column(db.DateTime, nullable=False)
+    import_batch_id = db.Column(db.Integer, db.ForeignKey('import_batch.id'))
+    __table_args__ = (
+        db.Index('ix_discount_history_combination', 'complex_id', 'type_id', 'payment_type_id', 'valid_from'),
+    )
@@ -0,0 +1,56 @@
+import logging
+import threading
+from typing import Callable, Dict, Any, Tuple
+from flask import render_template
+from markupsafe import Markup
+from discount_cache import GenerationCounter, discount_cache
+
+logger = logging.getLogger(__name__)
+
+# Bumped whenever a comment is posted
+comment_generation = GenerationCounter('comments')
+
+
+class FragmentCache:
+    """
+    Rendered template fragments per user role, valid for one data version.
+
+    The version is the pair (discount generation, comment generation); one entry
+    per (template, role) is kept, so the cache never grows past the number of roles.
+    """
+
+    def __init__(self):
+        self._entries: Dict[Tuple[str, str], Tuple[Tuple[int, int], Markup]] = {}
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        comment_generation.init_app(app)
+        app.extensions['fragment_cache'] = self
+
+    @staticmethod
+    def version() -> Tuple[int, int]:
+        return discount_cache.version(), comment_generation.read()
+
+    def render(self, template: str, role: str, load_context: Callable[[], Dict[str, Any]]) -> Markup:
+        """
+        Render `template` for `role`, or reuse the output rendered for the current data version.
+
+        :param template: Fragment template name
+        :param role: Role of the current user; the fragment sees it as `role`
+        :param load_context: Returns the template context; only called on a miss
+        :return: Rendered HTML
+        """
+        key = (template, role)
+        # Read the version before loading: data changing mid-render leaves a stale version behind
+        version = self.version()
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] == version:
+            return entry[1]
+        html = Markup(render_template(template, role=role, **load_context()))
+        with self._lock:
+            self._entries[key] = (version, html)
+        logger.debug("Rendered %s for role '%s'", template, role)
+        return html
+
+
+fragment_cache = FragmentCache()
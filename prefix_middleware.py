@@ -1,38 +1,48 @@
+import logging
+
+logger = logging.getLogger(__name__)
+
+
 class PrefixMiddleware:
     """
     Middleware for handling URL prefixes when an app is behind a reverse proxy.
+
+    Matching is two string comparisons per request and the environ is only touched
+    when a path has to be rewritten.
     """
     def __init__(self, wsgi_app, app=None, prefix='/discount-system'):
         self.wsgi_app = wsgi_app
         self.app = app
         self.prefix = prefix.rstrip('/')
+        self.prefix_slash = self.prefix + '/'
+        self.prefix_len = len(self.prefix)
         
-        print(f"PrefixMiddleware initialized with prefix: '{self.prefix}'")
+        logger.info("PrefixMiddleware initialized with prefix: '%s'", self.prefix)
         
         if app is not None:
             # Configure Flask app correctly
             app.config['APPLICATION_ROOT'] = self.prefix
             # Update static URL path
             app.static_url_path = self.prefix + '/static'
-            print(f"Updated static_url_path to: {app.static_url_path}")
+            logger.info("Updated static_url_path to: %s", app.static_url_path)
     
     def __call__(self, environ, start_response):
-        script_name = environ.get('SCRIPT_NAME', '')
         path_info = environ.get('PATH_INFO', '')
         
-        # Debug log every request
-        print(f"Request before middleware: SCRIPT_NAME='{script_name}', PATH_INFO='{path_info}'")
-        
         # If path starts with prefix, adjust PATH_INFO and SCRIPT_NAME
-        if path_info.startswith(self.prefix):
-            environ['SCRIPT_NAME'] = script_name + self.prefix
-            environ['PATH_INFO'] = path_info[len(self.prefix):] or '/'
-            print(f"Path adjusted: SCRIPT_NAME='{environ['SCRIPT_NAME']}', PATH_INFO='{environ['PATH_INFO']}'")
+        if path_info == self.prefix or path_info.startswith(self.prefix_slash):
+            environ['SCRIPT_NAME'] = environ.get('SCRIPT_NAME', '') + self.prefix
+            environ['PATH_INFO'] = path_info[self.prefix_len:] or '/'
         
         # Special handling for static file requests
         elif path_info.startswith('/static'):
             # This might be a static file request without prefix
             environ['PATH_INFO'] = self.prefix + path_info
-            print(f"Rewriting static path to: {environ['PATH_INFO']}")
         
+        else:
+            return self.wsgi_app(environ, start_response)
+        
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Path rewritten", extra={'from_path': path_info, 'script_name': environ.get('SCRIPT_NAME', ''),
+                                                  'path_info': environ['PATH_INFO']})
         return self.wsgi_app(environ, start_response)
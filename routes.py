@@ -1,13 +1,29 @@
 import math
-from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify
+from flask import Blueprint, Response, render_template, request, redirect, url_for, flash, jsonify, make_response, send_file, abort
 from werkzeug.security import generate_password_hash, check_password_hash
 from werkzeug.utils import secure_filename
 import os
+import json
+import time
 import base64
-from models import Comment, db, User, Complex, PropertyType, PaymentType, DiscountObject
-from services import DataSyncService
+from datetime import datetime
+import logging
+from models import Comment, CommentFormat, db, User, Complex, PropertyType, PaymentType, DiscountObject
+from comment_format import format_comment_text, build_comment_format
+from discount_cache import discount_cache
+from database import read_bind_arguments
+from jobs import import_jobs
+from sheet_schema import ALL_SHEETS
+from mail_queue import mail_queue
+from matrix_export import matrix_export, xlsx_export
+import discount_history
+from user_cache import user_cache, UserIdentity
+from page_cache import fragment_cache, comment_generation
+from updates import update_broadcaster
 import utils
 
+logger = logging.getLogger(__name__)
+
 # Create blueprints
 dashboard_bp = Blueprint('dashboard', __name__)
 admin_bp = Blueprint('admin', __name__)
@@ -16,6 +32,12 @@ api_bp = Blueprint('api', __name__)
 
 # Add a helper function at the top of the file to handle prefix in URLs
 
+# Upper bound for explicit combinations in one /api/discounts/batch call
+MAX_BATCH_COMBINATIONS = 1000
+
+# Seconds clients may reuse /api/discounts/matrix before revalidating with If-None-Match
+MATRIX_MAX_AGE = int(os.getenv('MATRIX_MAX_AGE', 0))
+
 # Check if app is behind proxy
 behind_proxy = os.getenv('BEHIND_PROXY', 'false').lower() == 'true'
 prefix = '/discount-system' if behind_proxy else ''
@@ -40,105 +62,103 @@ def decode_header_full_name(request):
     encoded_full_name = request.headers.get('X-User-Full-Name', '')
     encoding = request.headers.get('X-User-Full-Name-Encoding', '')
     
-    print(f"Received full name header: {encoded_full_name}, encoding: {encoding}")
-    
     if encoding == 'base64' and encoded_full_name:
         try:
             # Декодируем base64
             decoded_bytes = base64.b64decode(encoded_full_name)
-            decoded_name = decoded_bytes.decode('utf-8')
-            print(f"Decoded name: '{decoded_name}'")
-            return decoded_name
+            return decoded_bytes.decode('utf-8')
         except Exception as e:
-            print(f"Error decoding full name: {e}")
+            logger.warning(f"Error decoding full name: {e}")
             return encoded_full_name  # Возвращаем как есть, если декодирование не удалось
     else:
         return encoded_full_name  # Не закодировано или нет указания кодировки
 
 def get_current_user():
-    """Get current user information from request headers"""
+    """
+    Get current user information from request headers.
+    
+    Resolved users are cached per set of gateway headers; the database is only
+    queried on a cache miss and only written when the role or full name changed.
+    """
+    cache_key = user_cache.key_for(request.headers)
+    identity = user_cache.get(cache_key)
+    if identity is not None:
+        return identity
+    
     # Получение имени пользователя из заголовка аутентификации
     username = request.headers.get('X-User-Name')
-    # Поиск пользователя в базе данных
-    user = User.query.filter_by(login=username).first()
+    if not username:
+        return None
     
-    is_admin = request.headers.get('X-User-Admin', 'false').lower() == 'true'
     full_name = decode_header_full_name(request)
-
-    role_str = request.headers.get('X-User-Roles')
-    roles = str.split(role_str, ',')
-    role=''
-
+    roles = (request.headers.get('X-User-Roles') or '').split(',')
+    role = ''
     if 'discount-user' in roles or 'user' in roles:
         role = 'user'
     if 'discount-rop' in roles or 'rop' in roles:
         role = 'rop' 
     if 'admin' in roles or 'discount-admin' in roles:
         role = 'admin'
-    if user:
-        if user.role != 'admin' and is_admin:
-            user.role = 'admin'
-            db.session.commit()
-    print(f"User found: {user}, is_admin: {is_admin}")
-    # Если пользователь не найден, но у него есть доступ через шлюз (т.е. заголовок X-User-Name присутствует),
-    # создаем нового пользователя в базе данных
-    if not user and username:
-        # Получаем дополнительную информацию из заголовков и декодируем Base64 если нужно
-        full_name = decode_header_full_name(request)
-        
-        # Создаем нового пользователя с декодированным полным именем
-        user = User(
-            login=username,
-            full_name=full_name,
-            role=role
-        )
+    
+    # Поиск пользователя в базе данных
+    user = User.query.filter_by(login=username).first()
+    if not user:
+        # Пользователь прошёл через шлюз, но ещё не сохранён - создаем его
+        user = User(login=username, email=None, full_name=full_name, role=role)
         db.session.add(user)
-        
-    if user and ( user.full_name!=full_name):
+    elif user.full_name != full_name or user.role != role:
         user.full_name = full_name
-    if user and (user.role != role):
         user.role = role
-    try:
-        db.session.commit()  # This should set the user.id
-    except Exception as e:
-        db.session.rollback()
-        print(f"Error creating user: {str(e)}")
-    return user
-
-@admin_bp.app_template_filter('format_comment')
-def format_comment(text):
-    # Define patterns to recognize section headers and entries
-    import re
     
-    # Add line breaks before section headers
-    text = re.sub(r'(Изменение максимальных скидок)', r'\n\1', text)
-    
-    # Add line breaks before project entries
-    text = re.sub(r'([A-Za-zА-Яа-я\'\d-]+\s[A-Za-zА-Яа-я\'\d-]+(?:\s\(\d\))?\s*-)', r'\n\1', text)
-    
-    # Handle special cases for project names with numbers
-    text = re.sub(r'\n\n', r'\n', text)
+    if db.session.new or db.session.dirty:
+        try:
+            db.session.commit()  # This should set the user.id
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Error saving user {username}: {str(e)}")
+            # Another worker may have created the same login concurrently
+            user = User.query.filter_by(login=username).first()
+            if not user:
+                # Cached briefly so a failing save is not retried on every request
+                identity = UserIdentity(None, username, None, full_name, role)
+                user_cache.set(cache_key, identity, ttl=user_cache.fallback_ttl)
+                return identity
     
-    # Remove leading newline if present
-    if text.startswith('\n'):
-        text = text[1:]
-        
-    return text
+    identity = UserIdentity.from_user(user)
+    user_cache.set(cache_key, identity)
+    return identity
+
+@admin_bp.app_template_filter('format_comment')
+def format_comment(comment):
+    """Formatted comment text; parsed at save time, formatted on the fly for older comments."""
+    if isinstance(comment, Comment):
+        if comment.format is not None:
+            return comment.format.formatted_text
+        comment = comment.text
+    return format_comment_text(comment)
 
 # Dashboard routes
 @dashboard_bp.route('/')
 def index():
     current_user = get_current_user()
-    complexes = Complex.query.all()
-    property_types = PropertyType.query.all()
-    payment_types = PaymentType.query.all()
-    comment=Comment.query.order_by(Comment.created_at.desc()).first()
+    
+    def load_context():
+        # Read-only: served from the replica once it has had time to catch up
+        read = read_bind_arguments(max(fragment_cache.version()))
+        return dict(complexes=db.session.execute(db.select(Complex), **read).scalars().all(),
+                    property_types=db.session.execute(db.select(PropertyType), **read).scalars().all(),
+                    payment_types=db.session.execute(db.select(PaymentType), **read).scalars().all(),
+                    comment=db.session.execute(
+                        db.select(Comment).order_by(Comment.created_at.desc()).limit(1), **read
+                    ).scalars().first())
+    
+    # Dropdowns and the comment only change with a sync or a new comment
+    content = fragment_cache.render('dashboard/_content.html',
+                                    current_user.role if current_user else '', load_context)
     return render_template('dashboard/index.html', 
-                         complexes=complexes, 
-                         property_types=property_types,
-                         payment_types=payment_types,
+                         content=content,
                          current_user=current_user,
-                         comment=comment)
+                         updates_version=update_broadcaster.current_version())
 
 # Admin routes for data management
 @admin_bp.route('/upload-excel', methods=['GET', 'POST'])
@@ -155,14 +175,37 @@ def upload_excel():
             return redirect(request.url)
             
         try:
-            sync_service = DataSyncService()
-            sync_service.sync_from_upload(file)
-            flash('Data updated successfully!', 'success')
-            return redirect(get_prefix_url('/'))
+            # Every sheet of the workbook; a zip of workbooks is always read whole
+            sheet_name = ALL_SHEETS if request.form.get('all_sheets') else None
+            job_id = import_jobs.enqueue(file, sheet_name)
+            flash(f'File queued for import (job #{job_id})', 'success')
+            return redirect(get_prefix_url(f'/upload-excel?job={job_id}'))
         except Exception as e:
             flash(f'Error: {str(e)}', 'error')
 
-    return render_template('admin/upload.html', columns = os.getenv('EXCEL_COLUMNS').split(','), sheet = os.getenv('EXCEL_SHEET_NAME'), current_user=current_user)
+    return render_template('admin/upload.html', columns = os.getenv('EXCEL_COLUMNS').split(','), sheet = os.getenv('EXCEL_SHEET_NAME'), current_user=current_user,
+                           job_id=request.args.get('job', type=int))
+
+
+@admin_bp.route('/download-excel')
+def download_excel():
+    """Current discounts as a workbook that upload_excel accepts back unchanged."""
+    current_user = get_current_user()
+    if not current_user or current_user.role != 'admin':
+        abort(403)
+    
+    path, version = xlsx_export.get()
+    download_name = f"discounts-{datetime.now():%Y-%m-%d}.xlsx"
+    # The file is streamed from disk in blocks; the ETag lets an unchanged matrix answer 304
+    try:
+        response = send_file(path, as_attachment=True, etag=str(version), max_age=0, download_name=download_name)
+    except FileNotFoundError:
+        # A worker on a newer generation removed it in between: serve that one instead
+        path, version = xlsx_export.get()
+        response = send_file(path, as_attachment=True, etag=str(version), max_age=0, download_name=download_name)
+    response.cache_control.private = True
+    response.cache_control.must_revalidate = True
+    return response
 
 
 @admin_bp.route('/upload-comment', methods=['POST'])
@@ -175,9 +218,11 @@ def upload_comment():
             return redirect(request.referrer or get_prefix_url('/'))
         
         try:
-            new_comment = Comment(text=comment_text)
+            new_comment = Comment(text=comment_text, format=CommentFormat(**build_comment_format(comment_text)))
             db.session.add(new_comment)
             db.session.commit()
+            comment_generation.bump()
+            update_broadcaster.notify()
             flash('Comment added successfully!', 'success')
         except Exception as e:
             db.session.rollback()
@@ -196,21 +241,248 @@ def get_discounts():
     if not all([complex_id, type_id, payment_type_id]):
         return jsonify({'error': 'Missing parameters'}), 400
         
-    discount = DiscountObject.query.filter_by(
-        complex_id=complex_id,
-        type_id=type_id,
-        payment_type_id=payment_type_id
-    ).first()
+    discount = discount_cache.get(complex_id, type_id, payment_type_id)
     
     # Return 0 values if no discount found instead of 404
+    mpp, opt, kd = discount or (0, 0, 0)
     return jsonify({
-        'mpp_discount': round(discount.mpp_discount*100, 2) if discount else 0,
-        'opt_discount': round(discount.opt_discount*100, 2) if discount else 0,
-        'kd_discount': round(discount.kd_discount*100, 2) if discount else 0,
+        'mpp_discount': round(mpp*100, 2),
+        'opt_discount': round(opt*100, 2),
+        'kd_discount': round(kd*100, 2),
     })
     
+@api_bp.route('/api/discounts/batch', methods=['GET', 'POST'])
+def get_discounts_batch():
+    """
+    Discounts of many combinations in one call.
+    
+    POST {"combinations": [{"complex_id": 1, "type_id": 2, "payment_type_id": 3}, [1, 2, 4], ...]}
+    looks up explicit triples; GET with complex_id and/or payment_type_id (optionally
+    narrowed by type_id) returns every matching combination. Unknown combinations are
+    left out of the response.
+    """
+    current_user = get_current_user()
+    if request.method == 'POST':
+        combinations = (request.get_json(silent=True) or {}).get('combinations')
+        if not isinstance(combinations, list) or not combinations:
+            return jsonify({'error': 'Missing combinations'}), 400
+        if len(combinations) > MAX_BATCH_COMBINATIONS:
+            return jsonify({'error': f'At most {MAX_BATCH_COMBINATIONS} combinations per request'}), 400
+        try:
+            keys = []
+            for item in combinations:
+                if isinstance(item, dict):
+                    item = (item['complex_id'], item['type_id'], item['payment_type_id'])
+                complex_id, type_id, payment_type_id = (int(value) for value in item)
+                keys.append((complex_id, type_id, payment_type_id))
+        except (KeyError, TypeError, ValueError):
+            return jsonify({'error': 'Invalid combinations'}), 400
+        found = discount_cache.get_many(keys)
+    else:
+        complex_id = request.args.get('complex_id', type=int)
+        type_id = request.args.get('type_id', type=int)
+        payment_type_id = request.args.get('payment_type_id', type=int)
+        if complex_id is None and payment_type_id is None:
+            return jsonify({'error': 'Missing parameters'}), 400
+        found = discount_cache.select(complex_id, type_id, payment_type_id)
+    
+    return jsonify({'discounts': [
+        {
+            'complex_id': complex_id,
+            'type_id': type_id,
+            'payment_type_id': payment_type_id,
+            'mpp_discount': round(mpp*100, 2),
+            'opt_discount': round(opt*100, 2),
+            'kd_discount': round(kd*100, 2),
+        }
+        for (complex_id, type_id, payment_type_id), (mpp, opt, kd) in found
+    ]})
+    
+@api_bp.route('/api/discounts/matrix')
+def get_discount_matrix():
+    """Every discount with its complex, type and payment type names, as JSON or ?format=csv."""
+    current_user = get_current_user()
+    fmt = request.args.get('format', 'json')
+    if fmt not in matrix_export.FORMATS:
+        return jsonify({'error': 'Unsupported format'}), 400
+    
+    snapshot = matrix_export.get(fmt)
+    use_gzip = 'gzip' in request.accept_encodings
+    # Each encoding is its own representation and needs its own strong ETag
+    etag = snapshot.etag + ('-gz' if use_gzip else '')
+    if request.if_none_match.contains(etag):
+        response = make_response('', 304)
+    else:
+        response = make_response(snapshot.gzipped if use_gzip else snapshot.body)
+        response.mimetype = snapshot.mimetype
+        if use_gzip:
+            response.headers['Content-Encoding'] = 'gzip'
+        if fmt == 'csv':
+            response.headers['Content-Disposition'] = 'attachment; filename=discounts.csv'
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = f"private, max-age={MATRIX_MAX_AGE}, must-revalidate"
+    response.vary.add('Accept-Encoding')
+    return response
+    
+def _history_entry(version):
+    """A DiscountHistory row in the /api/discounts percent format."""
+    removed = version.mpp_discount is None
+    return {
+        'complex_id': version.complex_id,
+        'type_id': version.type_id,
+        'payment_type_id': version.payment_type_id,
+        'valid_from': version.valid_from.isoformat(timespec='seconds'),
+        'import_batch_id': version.import_batch_id,
+        'removed': removed,
+        'mpp_discount': None if removed else round(version.mpp_discount*100, 2),
+        'opt_discount': None if removed else round(version.opt_discount*100, 2),
+        'kd_discount': None if removed else round(version.kd_discount*100, 2),
+    }
+
+@api_bp.route('/api/discounts/history')
+def get_discount_history():
+    """Every version of one combination, oldest first; each is valid until the next one's valid_from."""
+    current_user = get_current_user()
+    complex_id = request.args.get('complex_id', type=int)
+    type_id = request.args.get('type_id', type=int)
+    payment_type_id = request.args.get('payment_type_id', type=int)
+    
+    if not all([complex_id, type_id, payment_type_id]):
+        return jsonify({'error': 'Missing parameters'}), 400
+    
+    versions = discount_history.combination_history(complex_id, type_id, payment_type_id)
+    return jsonify({'history': [_history_entry(version) for version in versions]})
+    
+@api_bp.route('/api/discounts/as-of')
+def get_discounts_as_of():
+    """
+    Discounts as they were at ?at=<ISO timestamp>, optionally narrowed by
+    complex_id, type_id and payment_type_id. A timestamp with an offset (or Z)
+    is converted to the server's local time, in which history is stored.
+    """
+    current_user = get_current_user()
+    try:
+        at = datetime.fromisoformat(request.args['at'])
+    except (KeyError, ValueError):
+        return jsonify({'error': 'Missing or invalid "at" timestamp'}), 400
+    if at.tzinfo is not None:
+        at = at.astimezone().replace(tzinfo=None)
+    
+    versions = discount_history.as_of(at,
+                                      complex_id=request.args.get('complex_id', type=int),
+                                      type_id=request.args.get('type_id', type=int),
+                                      payment_type_id=request.args.get('payment_type_id', type=int))
+    return jsonify({'at': at.isoformat(timespec='seconds'),
+                    'discounts': [_history_entry(version) for version in versions]})
+    
+@api_bp.route('/api/comments/latest')
+def get_latest_comment():
+    current_user = get_current_user()
+    # Comments are shown to rop and admin only, as on the dashboard
+    if not current_user or current_user.role not in ('rop', 'admin'):
+        return jsonify({'error': 'Forbidden'}), 403
+    comment = Comment.query.order_by(Comment.created_at.desc()).first()
+    if comment is None:
+        return jsonify({'comment': None})
+    
+    if comment.format is None:
+        comment_format = build_comment_format(comment.text)
+    else:
+        comment_format = {'formatted_text': comment.format.formatted_text, 'structure': comment.format.structure}
+    return jsonify({'comment': {
+        'id': comment.id,
+        'created_at': comment.created_at.isoformat(timespec='seconds'),
+        'text': comment.text,
+        'formatted_text': comment_format['formatted_text'],
+        'structure': json.loads(comment_format['structure']),
+    }})
+    
+def _visible_updates(payloads, current_user):
+    """Comments are only shown to rop and admin users, so only they get comment updates."""
+    if current_user and current_user.role in ('rop', 'admin'):
+        return payloads
+    return [payload for payload in payloads if payload['type'] != 'comment']
+
+@api_bp.route('/api/updates/stream')
+def stream_updates():
+    """
+    Server-Sent Events with discount and comment deltas for an open dashboard.
+    
+    Each stream lasts SSE_STREAM_SECONDS; the browser reconnects on its own and sends
+    the last event id back, so nothing is missed in between. 503 when this worker
+    has no free client slot: the page then falls back to /api/updates.
+    """
+    current_user = get_current_user()
+    since = request.headers.get('Last-Event-ID') or request.args.get('since')
+    update_broadcaster.start()
+    if not update_broadcaster.acquire():
+        response = jsonify({'error': 'Too many update listeners'})
+        response.status_code = 503
+        response.headers['Retry-After'] = '30'
+        return response
+    
+    def events(version):
+        yield 'retry: 3000\n\n'
+        deadline = time.monotonic() + update_broadcaster.stream_seconds
+        while (remaining := deadline - time.monotonic()) > 0:
+            payloads, new_version = update_broadcaster.wait(version, min(15.0, remaining))
+            if new_version == version:
+                yield ': keepalive\n\n'
+                continue
+            version = new_version
+            visible = _visible_updates(payloads, current_user)
+            if not visible:
+                # Still moves the browser's Last-Event-ID past this version
+                yield f"id: {version}\nevent: version\ndata: {{}}\n\n"
+            for payload in visible:
+                yield f"id: {version}\nevent: {payload['type']}\ndata: {json.dumps(payload)}\n\n"
+    
+    response = Response(events(since), mimetype='text/event-stream')
+    # Released when the server closes the response, which also happens when the body is
+    # never iterated (HEAD, a client gone before the first chunk)
+    response.call_on_close(update_broadcaster.release)
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'  # Stop nginx from buffering the stream
+    return response
+    
+@api_bp.route('/api/updates')
+def poll_updates():
+    """
+    Long-poll fallback of /api/updates/stream: waits up to LONG_POLL_SECONDS for a change after ?since.
+    
+    Without a free waiting slot it answers at once with the changes so far and a
+    retry_after, which turns the client into a plain poller instead of holding a thread.
+    """
+    current_user = get_current_user()
+    since = request.args.get('since')
+    update_broadcaster.start()
+    with update_broadcaster.client() as admitted:
+        payloads, version = update_broadcaster.wait(since, update_broadcaster.long_poll_seconds if admitted else 0)
+    result = {'version': version, 'events': _visible_updates(payloads, current_user)}
+    if not admitted:
+        result['retry_after'] = 30
+    return jsonify(result)
+    
+@api_bp.route('/api/import-jobs/<int:job_id>')
+def get_import_job(job_id):
+    current_user = get_current_user()
+    if not current_user or current_user.role != 'admin':
+        return jsonify({'error': 'Forbidden'}), 403
+    
+    job = import_jobs.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job)
+    
 def init_app(app):
     """Register all blueprints with the app"""
+    discount_cache.init_app(app)
+    user_cache.init_app(app)
+    fragment_cache.init_app(app)
+    import_jobs.init_app(app)
+    xlsx_export.init_app(app)
+    update_broadcaster.init_app(app)
+    mail_queue.init_app(app)
     app.register_blueprint(dashboard_bp, url_prefix='/')
     app.register_blueprint(admin_bp, url_prefix='/')
     app.register_blueprint(api_bp)
@@ -1,12 +1,31 @@
 import os
+import time
+import json
+import hashlib
 import logging
-from typing import Optional, List, Dict, Any
+import urllib.parse
+import tempfile
+import zipfile
+import unicodedata
+import multiprocessing
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from typing import Optional, List, Dict, Any, Callable, Iterable, Iterator, Tuple, Union
 import pandas as pd
+import openpyxl
 import sqlite3
 from dotenv import load_dotenv
-from models import db, PropertyType, Complex, DiscountObject, PaymentType
+from sqlalchemy.exc import IntegrityError
+from models import db, PropertyType, Complex, DiscountObject, PaymentType, Comment, CommentFormat, ImportBatch
+from comment_format import build_comment_format
+from discount_cache import discount_cache
+import discount_history
+from page_cache import comment_generation
+from updates import update_broadcaster
+import metrics
+from sheet_schema import ALL_SHEETS, NAME_COLUMNS, DISCOUNT_COLUMNS, configured_columns
 
-logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
 
 class ExcelDataService:
@@ -29,12 +48,12 @@ class ExcelDataService:
         else:
             self.columns = None # Read all columns if none specified
 
-    def get_data_from_excel(self, sheet_name: Optional[str] = None) -> List[Dict[str, Any]]:
+    def get_frame_from_excel(self, sheet_name: Optional[str] = None) -> pd.DataFrame:
         """
-        Reads data from the Excel file.
+        Reads data from the Excel file into a DataFrame.
         
         :param sheet_name: Name of the sheet to read. If None, uses EXCEL_SHEET_NAME from env.
-        :return: A list of dictionaries with the Excel data.
+        :return: DataFrame with the Excel data.
         """
         if not os.path.exists(self.excel_file_path):
             raise FileNotFoundError(f"Excel file not found at {self.excel_file_path}")
@@ -43,27 +62,236 @@ class ExcelDataService:
             sheet = sheet_name or os.getenv("EXCEL_SHEET_NAME")
             
             if self.columns:
-                df = pd.read_excel(self.excel_file_path, sheet_name=sheet, usecols=self.columns)
-            else:
-                df = pd.read_excel(self.excel_file_path, sheet_name=sheet)
-            
-            # Convert NaN to None for JSON compatibility
-            df = df.where(pd.notnull(df), None)
-            return df.to_dict(orient='records')
+                return pd.read_excel(self.excel_file_path, sheet_name=sheet, usecols=self.columns)
+            return pd.read_excel(self.excel_file_path, sheet_name=sheet)
         except Exception as e:
             raise ValueError(f"Error reading Excel file: {e}")
 
+    def get_data_from_excel(self, sheet_name: Optional[str] = None) -> List[Dict[str, Any]]:
+        """
+        Reads data from the Excel file.
+        
+        :param sheet_name: Name of the sheet to read. If None, uses EXCEL_SHEET_NAME from env.
+        :return: A list of dictionaries with the Excel data.
+        """
+        df = self.get_frame_from_excel(sheet_name)
+        # Convert NaN to None for JSON compatibility
+        df = df.astype(object).where(pd.notnull(df), None)
+        return df.to_dict(orient='records')
+
+
+def read_excel_chunks(source, sheet_name: Optional[str] = None, columns: Optional[List[str]] = None,
+                      chunk_size: int = 5000) -> Iterator[pd.DataFrame]:
+    """
+    Stream a worksheet as DataFrames of at most chunk_size rows.
+    
+    Uses openpyxl read-only mode, so only the rows of the current chunk are held in
+    memory. The index of every chunk is the 0-based data row of the sheet, which keeps
+    rejection reports pointing at the right Excel line.
+    
+    :param source: Path or binary file object of an .xlsx workbook
+    :param sheet_name: Name of the sheet to read. If None, the active sheet is used.
+    :param columns: Columns to keep. If None, every titled column is kept.
+    :param chunk_size: Maximum number of rows per DataFrame
+    :return: Iterator of DataFrames
+    """
+    workbook = openpyxl.load_workbook(source, read_only=True, data_only=True)
+    try:
+        if sheet_name and sheet_name not in workbook.sheetnames:
+            raise ValueError(f"Worksheet named '{sheet_name}' not found")
+        sheet = workbook[sheet_name] if sheet_name else workbook.active
+        rows = sheet.iter_rows(values_only=True)
+        header = [str(cell).strip() if cell is not None else '' for cell in next(rows, ())]
+        wanted = columns or [title for title in header if title]
+        missing = [column for column in wanted if column not in header]
+        if missing:
+            raise ValueError(f"Missing columns: {', '.join(missing)}")
+        positions = [header.index(column) for column in wanted]
+        
+        buffer, index = [], []
+        for number, row in enumerate(rows):
+            values = [row[i] if i < len(row) else None for i in positions]
+            # Read-only sheets often report trailing blank rows
+            if all(value is None for value in values):
+                continue
+            buffer.append(values)
+            index.append(number)
+            if len(buffer) >= chunk_size:
+                yield pd.DataFrame(buffer, columns=wanted, index=index)
+                buffer, index = [], []
+        if buffer:
+            yield pd.DataFrame(buffer, columns=wanted, index=index)
+    finally:
+        workbook.close()
+
+
+WORKBOOK_EXTENSIONS = ('.xlsx', '.xlsm', '.xls')
+
+
+def parse_sheet(path: str, sheet_name: str, columns: Optional[List[str]], label: str) -> Dict[str, Any]:
+    """
+    Read and normalize one sheet. Runs in a worker process of a multi-sheet import.
+    
+    The sheet is read in chunks and every chunk is normalized on its own, so only the
+    raw rows of one chunk are held at a time. The normalized rows of the whole sheet are
+    still returned as one frame: a multi-sheet import needs memory for its largest
+    sheet, unlike a single-sheet upload, which streams.
+    
+    :param path: Workbook path
+    :param sheet_name: Sheet to read
+    :param columns: Columns to keep, None for all
+    :param label: Sheet name shown in error reports
+    :return: {"sheet", "frame", "rejected", "rows"}, or {"sheet", "error"} if the sheet could not be read
+    """
+    try:
+        if path.lower().endswith('.xls'):
+            chunks = [pd.read_excel(path, sheet_name=sheet_name, usecols=columns)]
+        else:
+            chunks = read_excel_chunks(path, sheet_name, columns)
+        frames, rejected, rows = [], [], 0
+        for chunk in chunks:
+            frame, chunk_rejected = normalize_discount_frame(chunk)
+            frames.append(frame)
+            rejected.extend(chunk_rejected)
+            rows += len(chunk)
+        frame = pd.concat(frames) if frames else normalize_discount_frame(pd.DataFrame(columns=columns))[0]
+    except Exception as e:
+        return {'sheet': label, 'error': str(e)}
+    for item in rejected:
+        item['sheet'] = label
+    return {'sheet': label, 'frame': frame, 'rejected': rejected, 'rows': rows}
+
 
 class SQLiteDataService:
-    def __init__(self, env_file_path: str = ".env", db_path: Optional[str] = None):
-        """Initialize the service with the SQLite database path."""
+    """
+    Discount rows from an external SQLite dump, read without loading the table.
+    
+    The database is opened once per service, read-only (URI mode=ro, query_only) and
+    memory-mapped (SQLITE_MMAP_SIZE bytes). Rows are streamed with fetchmany. Table and
+    column names are checked against the database schema before they reach any SQL.
+    """
+    
+    def __init__(self, env_file_path: str = ".env", db_path: Optional[str] = None,
+                 table_name: Optional[str] = None, columns: Optional[List[str]] = None):
+        """
+        Initialize the service with the SQLite database path.
+        
+        :param db_path: Database file, DB_FILE_PATH from env if not given
+        :param table_name: Default table for iter_frames, SQLITE_SOURCE_TABLE from env if not given
+        :param columns: Source columns in EXCEL_COLUMNS order, SQLITE_COLUMNS from env if not given;
+                        defaults to the EXCEL_COLUMNS names themselves
+        """
         load_dotenv(env_file_path)
         self.db_path = db_path or os.getenv("DB_FILE_PATH")
         if not self.db_path:
             raise ValueError("SQLite database path not provided.")
         if not os.path.exists(self.db_path):
             raise FileNotFoundError(f"SQLite database file not found at {self.db_path}")
-
+        self.table_name = table_name or os.getenv("SQLITE_SOURCE_TABLE")
+        columns_str = os.getenv("SQLITE_COLUMNS")
+        self.columns = columns or ([col.strip() for col in columns_str.split(',')] if columns_str else None)
+        self.mmap_size = int(os.getenv("SQLITE_MMAP_SIZE", 256 * 1024 * 1024))
+        self.fetch_size = int(os.getenv("SQLITE_FETCH_SIZE", 5000))
+        self._conn: Optional[sqlite3.Connection] = None
+        self._schema: Dict[str, List[str]] = {}
+    
+    @property
+    def connection(self) -> sqlite3.Connection:
+        """The read-only connection, opened on first use."""
+        if self._conn is None:
+            uri = f"file:{urllib.parse.quote(os.path.abspath(self.db_path))}?mode=ro"
+            conn = sqlite3.connect(uri, uri=True, check_same_thread=False)
+            conn.execute("PRAGMA query_only = ON")
+            conn.execute(f"PRAGMA mmap_size = {int(self.mmap_size)}")
+            self._conn = conn
+        return self._conn
+    
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+    
+    def table_columns(self, table_name: str) -> List[str]:
+        """
+        Columns of a table, which must exist in the database.
+        
+        :raises ValueError: For an unknown table
+        """
+        if table_name not in self._schema:
+            tables = {row[0] for row in self.connection.execute(
+                "SELECT name FROM sqlite_master WHERE type IN ('table', 'view')")}
+            if table_name not in tables:
+                raise ValueError(f"Unknown SQLite table: {table_name}")
+            self._schema[table_name] = [row[1] for row in self.connection.execute(
+                f'PRAGMA table_info({self._quote(table_name)})')]
+        return self._schema[table_name]
+    
+    def iter_rows(self, table_name: str, columns: Optional[List[str]] = None,
+                  watermark_column: Optional[str] = None, since: Any = None) -> Iterator[List[tuple]]:
+        """
+        Stream a table in batches of SQLITE_FETCH_SIZE rows.
+        
+        :param table_name: Table to read; must exist in the database
+        :param columns: Columns to select, all if None; each must exist in the table
+        :param watermark_column: Column (or rowid) ordering the rows; appended as the last value of every row
+        :param since: Only rows whose watermark is greater than this value
+        :return: Iterator of row batches
+        """
+        known = self.table_columns(table_name)
+        wanted = columns or known
+        unknown = [column for column in wanted if column not in known]
+        if watermark_column and watermark_column != 'rowid' and watermark_column not in known:
+            unknown.append(watermark_column)
+        if unknown:
+            raise ValueError(f"Unknown columns in {table_name}: {', '.join(unknown)}")
+        
+        selected = [self._quote(column) for column in wanted]
+        query, params = f'FROM {self._quote(table_name)}', []
+        if watermark_column:
+            watermark = 'rowid' if watermark_column == 'rowid' else self._quote(watermark_column)
+            selected.append(watermark)
+            if since is not None:
+                query += f" WHERE {watermark} > ?"
+                params.append(since)
+            query += f" ORDER BY {watermark}"
+        cursor = self.connection.execute(f"SELECT {', '.join(selected)} {query}", params)
+        try:
+            while batch := cursor.fetchmany(self.fetch_size):
+                yield batch
+        finally:
+            cursor.close()
+    
+    def iter_frames(self, watermark_column: Optional[str] = None, since: Any = None,
+                    table_name: Optional[str] = None) -> Iterator[pd.DataFrame]:
+        """
+        Stream the source table as DataFrames with the Excel column names, for DataSyncService.
+        
+        With a watermark column, each frame also has a "watermark" column.
+        
+        :param watermark_column: Column (or rowid) for incremental pulls
+        :param since: Last watermark already imported
+        :param table_name: Table to read instead of the configured one
+        """
+        table_name = table_name or self.table_name
+        if not table_name:
+            raise ValueError("SQLite source table not configured (SQLITE_SOURCE_TABLE).")
+        excel_columns = DataSyncService._columns() or list(NAME_COLUMNS) + list(DISCOUNT_COLUMNS)
+        source_columns = self.columns or excel_columns
+        if len(source_columns) != len(excel_columns):
+            raise ValueError("SQLITE_COLUMNS must list one source column per EXCEL_COLUMNS entry.")
+        names = excel_columns + (['watermark'] if watermark_column else [])
+        offset = 0
+        for batch in self.iter_rows(table_name, source_columns, watermark_column, since):
+            yield pd.DataFrame(batch, columns=names, index=range(offset, offset + len(batch)))
+            offset += len(batch)
+    
+    @staticmethod
+    def _quote(name: str) -> str:
+        """Quote a table or column name already checked against the schema."""
+        if '"' in name:
+            raise ValueError(f"Unsupported SQLite identifier: {name}")
+        return f'"{name}"'
+    
     def get_data_from_sqlite(self, table_name: str, columns: Optional[List[str]] = None) -> List[Dict[str, Any]]:
         """
         Fetches data from the specified table in the SQLite database.
@@ -72,43 +300,169 @@ class SQLiteDataService:
         :param columns: Optional list of column names to select. If None, selects all columns.
         :return: A list of dictionaries, where each dictionary represents a row.
         """
-        conn = None
         try:
-            conn = sqlite3.connect(self.db_path)
-            conn.row_factory = sqlite3.Row  # Access columns by name
-            cursor = conn.cursor()
-
-            if columns:
-                # Sanitize column names to prevent SQL injection if they are not hardcoded
-                # For simplicity, assuming columns are trusted or validated elsewhere
-                cols_str = ", ".join(f'"{col}"' for col in columns) # Quote column names
-            else:
-                cols_str = "*"
-            
-            # Sanitize table_name if it's dynamic, for now assuming it's safe
-            query = f'SELECT {cols_str} FROM "{table_name}"' # Quote table name
-            
-            cursor.execute(query)
-            rows = cursor.fetchall()
-            return [dict(row) for row in rows]
+            names = columns or self.table_columns(table_name)
+            return [dict(zip(names, row)) for batch in self.iter_rows(table_name, columns) for row in batch]
         except sqlite3.Error as e:
-            # Log the exception e
             raise ValueError(f"SQLite error: {e}")
-        finally:
-            if conn:
-                conn.close()
+
+
+def normalize_discount_frame(df: pd.DataFrame) -> Tuple[pd.DataFrame, List[Dict[str, Any]]]:
+    """
+    Validate and convert a sheet of discounts with whole-column operations.
+    
+    Names are converted to trimmed strings, discount cells lose their percent sign and are
+    coerced to float (empty cells count as 0). Rows with a missing name or a non-numeric
+    discount are left out and described in the rejection list.
+    
+    :param df: Raw sheet with the Excel column names; the index is the 0-based data row
+    :return: (frame with complex, property_type, payment_type and the three discount
+             columns, list of rejected rows as {"row", "reason"} dictionaries)
+    """
+    clean = pd.DataFrame(index=df.index)
+    failures = []  # (column, mask of failing rows, raw values or None)
+    
+    for column, attr in NAME_COLUMNS.items():
+        values = df[column] if column in df else pd.Series(None, index=df.index, dtype=object)
+        present = values.notna()
+        names = values.astype(object).where(~present, values.astype(str).str.strip())
+        failures.append((column, ~present | (names == ''), None))
+        clean[attr] = names
+    
+    for column, attr in DISCOUNT_COLUMNS.items():
+        values = df[column] if column in df else pd.Series(0.0, index=df.index)
+        if pd.api.types.is_numeric_dtype(values):
+            numbers = values.astype(float)
+        else:
+            text = values.astype(str).str.replace('%', '', regex=False).str.strip()
+            empty = values.isna() | (text == '')
+            numbers = pd.to_numeric(text.mask(empty, '0'), errors='coerce')
+            failures.append((column, numbers.isna(), values))
+        clean[attr] = numbers.fillna(0.0)
+    
+    rejected_mask = pd.Series(False, index=df.index)
+    for _, mask, _ in failures:
+        rejected_mask |= mask
+    
+    # Only the rejected rows are described one by one
+    reasons = {row: [] for row in df.index[rejected_mask]}
+    for column, mask, values in failures:
+        for row in df.index[mask]:
+            reasons[row].append(f"missing {column}" if values is None else f"invalid {column}: {values[row]}")
+    rejected = [
+        # +2: 1-based rows and the header line
+        {'row': int(row) + 2, 'reason': '; '.join(problems)}
+        for row, problems in reasons.items()
+    ]
+    return clean[~rejected_mask], rejected
+
+
+def file_fingerprint(source, sheet: Optional[str] = None, block_size: int = 1024 * 1024) -> str:
+    """
+    SHA-256 of a workbook, read in blocks so large files are never held in memory.
+    
+    :param source: Path or seekable binary file object; file objects are rewound afterwards
+    :param sheet: Sheet the file is read with (a name or ALL_SHEETS); the same file read
+                  with another selection imports other rows, so it fingerprints differently
+    :return: Hex digest
+    """
+    digest = hashlib.sha256()
+    if sheet:
+        digest.update(f"sheet:{sheet}\0".encode('utf-8'))
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, 'rb') as f:
+            for block in iter(lambda: f.read(block_size), b''):
+                digest.update(block)
+    else:
+        source.seek(0)
+        for block in iter(lambda: source.read(block_size), b''):
+            digest.update(block)
+        source.seek(0)
+    return digest.hexdigest()
+
+
+def name_key(name: str) -> str:
+    """
+    Lookup key of a complex, property type or payment type name.
+    
+    Trimmed, case-folded and stripped of accents, the way MySQL's default *_ai_ci
+    collations compare names: "ЖК Ёлка" and "жк елка" share a key.
+    """
+    decomposed = unicodedata.normalize('NFKD', name.strip().casefold())
+    return ''.join(char for char in decomposed if not unicodedata.combining(char))
+
+
+def discount_hash(mpp: float, opt: float, kd: float) -> int:
+    """Content hash of a discount row, rounded so float column precision does not count as a change."""
+    return hash((round(mpp or 0.0, 6), round(opt or 0.0, 6), round(kd or 0.0, 6)))
+
+
+@dataclass
+class SyncReport:
+    """Outcome of a discount sync."""
+    inserted: int = 0
+    updated: int = 0
+    unchanged: int = 0
+    removed: int = 0
+    skipped: int = 0
+    processed: int = 0
+    elapsed: float = 0.0
+    fingerprint: Optional[str] = None
+    identical: bool = False
+    sheets: int = 0
+    rejected: List[Dict[str, Any]] = field(default_factory=list)
+    # Sheets of a multi-sheet import that could not be read, as {"sheet", "error"}
+    sheet_errors: List[Dict[str, str]] = field(default_factory=list)
+    # One entry per added, changed or removed combination
+    diff: List[Dict[str, Any]] = field(default_factory=list)
+
+    # Keep the report small when a huge sheet is rejected wholesale
+    MAX_REJECTED = 1000
+
+    def add_rejected(self, rejected: List[Dict[str, Any]]):
+        self.skipped += len(rejected)
+        self.rejected.extend(rejected[:max(self.MAX_REJECTED - len(self.rejected), 0)])
+
+    def __str__(self):
+        if self.identical:
+            return "file is identical to the last import, nothing changed"
+        summary = (f"inserted {self.inserted}, updated {self.updated}, unchanged {self.unchanged}, "
+                   f"missing from file {self.removed}, skipped {self.skipped} in {self.elapsed:.2f} s")
+        if self.sheet_errors:
+            summary += f", {len(self.sheet_errors)} of {self.sheets} sheets unreadable"
+        return summary
 
 
 class DataSyncService:
     """Service to synchronize data between Excel and the database."""
     
-    def __init__(self, excel_service: Optional[ExcelDataService] = None):
+    def __init__(self, excel_service: Optional[ExcelDataService] = None,
+                 progress: Optional[Callable[[int], None]] = None):
         """
         Initialize with an Excel data service.
         
         :param excel_service: Configured ExcelDataService instance (optional)
+        :param progress: Called with the number of sheet rows processed after each chunk (optional)
         """
         self.excel_service = excel_service
+        self.progress = progress
+        self.batch_size = int(os.getenv("SYNC_BATCH_SIZE", 1000))
+        self.chunk_size = int(os.getenv("EXCEL_CHUNK_SIZE", 5000))
+        self.streaming_threshold = int(os.getenv("STREAMING_UPLOAD_THRESHOLD", 5 * 1024 * 1024))
+        self.parse_processes = int(os.getenv("IMPORT_PARSE_PROCESSES", os.cpu_count() or 1))
+        self.max_archive_bytes = int(os.getenv("IMPORT_ZIP_MAX_BYTES", 500 * 1024 * 1024))
+        self.prune_missing = os.getenv("SYNC_PRUNE_MISSING", "false").lower() == "true"
+        self.auto_comment = os.getenv("SYNC_AUTO_COMMENT", "false").lower() == "true"
+        self._name_maps: Dict[Any, Dict[str, Tuple[int, str]]] = {}
+        self._existing: Optional[Dict[Tuple[int, int, int], Tuple[int, int]]] = None
+        self._inserted: set = set()
+        self._seen: set = set()
+        # Diff entry of every combination this sync wrote, so a repeat updates it in place
+        self._diff_entries: Dict[Tuple[int, int, int], Dict[str, Any]] = {}
+        # Set by sync_from_sqlite for the duration of an incremental pull
+        self._source: Optional[str] = None
+        self._watermark: Any = None
+        self._incremental = False
     
     def sync_all_data(self):
         """Synchronize all data from Excel to the database using configured ExcelDataService."""
@@ -116,10 +470,10 @@ class DataSyncService:
             raise ValueError("Excel service not configured for sync_all_data operation")
             
         # Get data from excel - assumes the expected columns are present
-        data = self.excel_service.get_data_from_excel()
+        data = self.excel_service.get_frame_from_excel()
         
         # Process data through common sync pipeline
-        self._process_sync_data(data)
+        return self._process_sync_data(data)
     
     def sync_from_file(self, file_path: str, sheet_name: Optional[str] = None):
         """
@@ -127,172 +481,523 @@ class DataSyncService:
         
         :param file_path: Path to the Excel file to process
         :param sheet_name: Optional name of the sheet to read
+        :return: SyncReport with row counts and elapsed time
         """
         # Create a temporary ExcelDataService with the provided file
         temp_service = ExcelDataService(excel_path=file_path)
         
         # Get data from the specified file
-        data = temp_service.get_data_from_excel(sheet_name)
+        data = temp_service.get_frame_from_excel(sheet_name)
         
         # Process data through common sync pipeline
-        self._process_sync_data(data)
+        sheet = sheet_name or os.getenv("EXCEL_SHEET_NAME")
+        return self._process_sync_data(data, fingerprint=file_fingerprint(file_path, sheet))
         
     def sync_from_upload(self, file_object, sheet_name: Optional[str] = None):
         """
         Synchronize data from an uploaded file object (e.g., from Flask request.files).
         
+        Workbooks of STREAMING_UPLOAD_THRESHOLD bytes or more are streamed in chunks of
+        EXCEL_CHUNK_SIZE rows instead of being loaded whole. A zip of workbooks, or a
+        workbook with sheet_name ALL_SHEETS, goes through sync_workbooks.
+        
         :param file_object: The uploaded file object
-        :param sheet_name: Optional name of the sheet to read
+        :param sheet_name: Optional name of the sheet to read, ALL_SHEETS for every sheet
+        :return: SyncReport with row counts and elapsed time
         """
         try:
             # Get sheet name from environment if not provided
             sheet = sheet_name or os.getenv("EXCEL_SHEET_NAME")
             
+            # Re-uploading the last imported file is a no-op
+            fingerprint = file_fingerprint(file_object, sheet)
+            if self._is_last_import(fingerprint):
+                return SyncReport(fingerprint=fingerprint, identical=True)
+            
+            if sheet == ALL_SHEETS or self._is_archive(file_object):
+                return self.sync_workbooks(file_object, fingerprint)
+            
+            if self._should_stream(file_object):
+                chunks = read_excel_chunks(file_object, sheet, self._columns(), self.chunk_size)
+                return self._process_sync_frames(chunks, fingerprint)
+            
             # Read directly from the uploaded file using pandas
             df = pd.read_excel(file_object, sheet_name=sheet)
             
-            # Replace NaN values with None before converting to dict
-            df = df.replace({pd.NA: None})
-            data = df.to_dict(orient='records')
-            
             # Process data through common sync pipeline
-            self._process_sync_data(data)
+            return self._process_sync_data(df, fingerprint)
         except Exception as e:
             raise ValueError(f"Error processing uploaded Excel file: {e}")
     
-    def _process_sync_data(self, data: List[Dict[str, Any]]):
+    def sync_from_sqlite(self, sqlite_service: Optional[SQLiteDataService] = None,
+                         incremental: bool = True) -> SyncReport:
         """
-        Common method to process and sync data regardless of source.
+        Synchronize from the SQLite source table, streaming it in constant memory.
+        
+        With SQLITE_WATERMARK_COLUMN set (rowid, or an updated-at column for sources that
+        update rows in place) an incremental sync reads only the rows past the watermark
+        recorded by the previous SQLite import, and combinations not among them are left
+        alone. Otherwise, or with incremental=False, the whole table is read.
         
-        :param data: Excel data as a list of dictionaries
+        :param sqlite_service: Configured SQLiteDataService (optional)
+        :param incremental: Continue from the last recorded watermark
+        :return: SyncReport with row counts and elapsed time
         """
-        # Process and sync each type of data
-        self.sync_property_types(data)
-        self.sync_payment_types(data)
-        self.sync_complexes(data)
-        self.sync_discounts(data)
+        source = sqlite_service or SQLiteDataService()
+        watermark_column = os.getenv("SQLITE_WATERMARK_COLUMN") or None
+        self._source = f"sqlite:{os.path.basename(source.db_path)}:{source.table_name}"
+        self._incremental = incremental and watermark_column is not None
+        self._watermark = self._last_watermark(self._source) if self._incremental else None
+        try:
+            frames = source.iter_frames(watermark_column, self._watermark)
+            if watermark_column:
+                frames = self._track_watermark(frames)
+            return self._process_sync_frames(frames)
+        finally:
+            self._source, self._watermark, self._incremental = None, None, False
+            if sqlite_service is None:
+                source.close()
+    
+    def _track_watermark(self, frames: Iterable[pd.DataFrame]) -> Iterator[pd.DataFrame]:
+        """Remember the highest watermark read; frames arrive in watermark order."""
+        for frame in frames:
+            if len(frame):
+                value = frame['watermark'].iloc[-1]
+                self._watermark = value.item() if hasattr(value, 'item') else value
+            yield frame.drop(columns='watermark')
+    
+    def _last_watermark(self, source: str) -> Any:
+        watermark = db.session.execute(
+            db.select(ImportBatch.watermark).where(ImportBatch.source == source)
+            .order_by(ImportBatch.id.desc()).limit(1)
+        ).scalar()
+        return json.loads(watermark) if watermark else None
+    
+    def sync_workbooks(self, file_object, fingerprint: Optional[str] = None) -> SyncReport:
+        """
+        Synchronize every sheet of a workbook, or of every workbook in a zip, in one transaction.
         
-        # Commit all changes to the database
-        db.session.commit()
+        Sheets are parsed in parallel by IMPORT_PARSE_PROCESSES worker processes and
+        applied in workbook order, so a combination repeated on a later sheet wins. A
+        sheet that cannot be read is listed in report.sheet_errors and the others are
+        still imported.
+        
+        :param file_object: Uploaded workbook or zip archive
+        :param fingerprint: SHA-256 of the upload, recorded on the import batch
+        :return: SyncReport with row counts, elapsed time and per-sheet errors
+        """
+        report = SyncReport(fingerprint=fingerprint)
+        with tempfile.TemporaryDirectory(prefix='discount-import-') as workdir:
+            tasks = []
+            for label, path in self._workbook_paths(file_object, workdir):
+                try:
+                    sheets = self._sheet_names(path)
+                except Exception as e:
+                    report.sheet_errors.append({'sheet': label, 'error': str(e)})
+                    continue
+                tasks.extend((path, sheet, self._columns(), f"{label} / {sheet}" if label else sheet)
+                             for sheet in sheets)
+            report.sheets = len(tasks) + len(report.sheet_errors)
+            
+            def parts():
+                for result in self._parse_sheets(tasks):
+                    if 'error' in result:
+                        logger.warning("Skipping sheet %s: %s", result['sheet'], result['error'])
+                        report.sheet_errors.append({'sheet': result['sheet'], 'error': result['error']})
+                        continue
+                    yield result['frame'], result['rejected'], result['rows']
+            
+            return self._process_normalized(parts(), fingerprint, report)
     
-    def sync_property_types(self, data: List[Dict[str, Any]]):
+    def _parse_sheets(self, tasks: List[Tuple[str, str, Optional[List[str]], str]]) -> Iterator[Dict[str, Any]]:
+        """Run parse_sheet over the tasks, in a process pool when there is more than one sheet."""
+        processes = min(self.parse_processes, len(tasks))
+        if processes <= 1:
+            for task in tasks:
+                yield parse_sheet(*task)
+            return
+        # Fresh interpreters: forking a threaded web or import worker is not safe
+        context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=processes, mp_context=context) as executor:
+            # map keeps workbook order while the sheets are parsed concurrently
+            yield from executor.map(parse_sheet, *zip(*tasks))
+    
+    def _workbook_paths(self, file_object, workdir: str) -> List[Tuple[str, str]]:
         """
-        Synchronize property types from Excel data.
+        Put the workbooks of an upload on disk where worker processes can open them.
         
-        :param data: Excel data with "Тип" column
+        :return: (label, path) pairs; the label is the member name for zip archives, '' otherwise
         """
-        # Extract unique property types
-        unique_types = set(item.get("Тип") for item in data if item.get("Тип"))
+        if not self._is_archive(file_object):
+            path = getattr(file_object, 'name', None)
+            if not (isinstance(path, str) and os.path.isfile(path)):
+                filename = getattr(file_object, 'filename', None) or 'upload.xlsx'
+                path = os.path.join(workdir, f"upload{os.path.splitext(filename)[1].lower() or '.xlsx'}")
+                file_object.seek(0)
+                with open(path, 'wb') as f:
+                    while block := file_object.read(1024 * 1024):
+                        f.write(block)
+            return [('', path)]
         
-        # For each unique type, add if it doesn't exist
-        for type_name in unique_types:
-            existing_type = PropertyType.query.filter_by(name=type_name).first()
-            if not existing_type:
-                new_type = PropertyType(name=type_name)
-                db.session.add(new_type)
+        with zipfile.ZipFile(file_object) as archive:
+            members = [member for member in archive.infolist()
+                       if not member.is_dir() and not member.filename.startswith('__MACOSX/')
+                       and member.filename.lower().endswith(WORKBOOK_EXTENSIONS)]
+            if sum(member.file_size for member in members) > self.max_archive_bytes:
+                raise ValueError(f"Archive expands to more than {self.max_archive_bytes} bytes")
+            paths = []
+            for number, member in enumerate(sorted(members, key=lambda member: member.filename)):
+                # Our own file names: member paths from the archive are never trusted
+                path = os.path.join(workdir, f"{number}{os.path.splitext(member.filename)[1].lower()}")
+                with archive.open(member) as source, open(path, 'wb') as target:
+                    while block := source.read(1024 * 1024):
+                        target.write(block)
+                paths.append((member.filename, path))
+        file_object.seek(0)
+        if not paths:
+            raise ValueError("The archive contains no Excel workbooks")
+        return paths
+    
+    @staticmethod
+    def _sheet_names(path: str) -> List[str]:
+        if path.endswith('.xls'):
+            return pd.ExcelFile(path).sheet_names
+        workbook = openpyxl.load_workbook(path, read_only=True)
+        try:
+            return workbook.sheetnames
+        finally:
+            workbook.close()
+    
+    @staticmethod
+    def _is_archive(file_object) -> bool:
+        """True for a zip of workbooks; an xlsx file is a zip too, but has a content types part."""
+        file_object.seek(0)
+        try:
+            if not zipfile.is_zipfile(file_object):
+                return False
+            file_object.seek(0)
+            with zipfile.ZipFile(file_object) as archive:
+                return '[Content_Types].xml' not in archive.namelist()
+        finally:
+            file_object.seek(0)
+    
+    @staticmethod
+    def _columns() -> Optional[List[str]]:
+        return configured_columns()
     
-    def sync_payment_types(self, data: List[Dict[str, Any]]):
+    def _is_last_import(self, fingerprint: str) -> bool:
+        """Check whether the most recent import batch came from the same file."""
+        last = db.session.execute(
+            db.select(ImportBatch.fingerprint).order_by(ImportBatch.id.desc()).limit(1)
+        ).scalar()
+        return last == fingerprint
+    
+    def _should_stream(self, file_object) -> bool:
+        """Decide whether an upload is big enough for the streaming reader."""
+        # Uploads carry a filename; import jobs pass the stored file, whose path keeps the extension
+        filename = getattr(file_object, 'filename', None) or getattr(file_object, 'name', None)
+        if isinstance(filename, str) and filename.lower().endswith('.xls'):
+            return False  # openpyxl only reads the xlsx format
+        size = file_object.seek(0, os.SEEK_END)
+        file_object.seek(0)
+        return size >= self.streaming_threshold
+    
+    def _process_sync_data(self, data: Union[pd.DataFrame, List[Dict[str, Any]]],
+                           fingerprint: Optional[str] = None) -> SyncReport:
         """
-        Synchronize payment types from Excel data.
+        Common method to process and sync data regardless of source.
         
-        :param data: Excel data with "Вид оплаты" column
+        :param data: Excel data as a DataFrame or a list of dictionaries
+        :param fingerprint: SHA-256 of the source file, if there is one
+        :return: SyncReport with row counts and elapsed time
         """
-        # Extract unique payment types
-        unique_types = set(item.get("Вид оплаты") for item in data if item.get("Вид оплаты"))
-        
-        # For each unique type, add if it doesn't exist
-        for type_name in unique_types:
-            existing_type = PaymentType.query.filter_by(name=type_name).first()
-            if not existing_type:
-                new_type = PaymentType(name=type_name)
-                db.session.add(new_type)
+        df = data if isinstance(data, pd.DataFrame) else pd.DataFrame(data)
+        return self._process_sync_frames([df.reset_index(drop=True)], fingerprint)
     
-    def sync_complexes(self, data: List[Dict[str, Any]]):
+    def _process_sync_frames(self, frames: Iterable[pd.DataFrame], fingerprint: Optional[str] = None) -> SyncReport:
         """
-        Synchronize complexes from Excel data.
+        Sync a sequence of sheet chunks in a single transaction.
+        
+        Only combinations whose content hash differs from the stored row are written.
         
-        :param data: Excel data with "Название" column
+        :param frames: DataFrames with the Excel columns, indexed by 0-based sheet row
+        :param fingerprint: SHA-256 of the source file, recorded on the import batch
+        :return: SyncReport with row counts, elapsed time and the diff
         """
-        # Extract unique complexes
-        complex_names = set(item.get("Название") for item in data if item.get("Название"))
-                
-        # For each complex, add if it doesn't exist
-        for name in complex_names:
-            existing_complex = Complex.query.filter_by(name=name).first()
-            if not existing_complex:
-                new_complex = Complex(name=name)
-                db.session.add(new_complex)
+        parts = ((*normalize_discount_frame(df), len(df)) for df in frames)
+        return self._process_normalized(parts, fingerprint)
     
-    def sync_discounts(self, data: List[Dict[str, Any]]):
-        """Synchronize discount information."""
-        for item in data:
-            # Debug print raw data
-            logger.debug(f"Raw Excel row data: {item}")
-            
-            complex_name = item.get("Название")
-            property_type_name = item.get("Тип")
-            payment_type_name = item.get("Вид оплаты")
-            mpp_discount = item.get("Скидка МПП")  # Note exact column name match
-            opt_discount = item.get("Скидка РОП")  # Note exact column name match
-            kd_discount = item.get("Скидка КД")  # Note exact column name match
+    def _process_normalized(self, parts: Iterable[Tuple[pd.DataFrame, List[Dict[str, Any]], int]],
+                            fingerprint: Optional[str] = None, report: Optional[SyncReport] = None) -> SyncReport:
+        """
+        Apply already normalized sheet data in a single transaction.
+        
+        :param parts: (output of normalize_discount_frame..., number of sheet rows) per chunk or sheet
+        :param fingerprint: SHA-256 of the source file, recorded on the import batch
+        :param report: Report to fill in, created if not given
+        :return: SyncReport with row counts, elapsed time and the diff
+        """
+        started = time.perf_counter()
+        report = report or SyncReport(fingerprint=fingerprint)
+        self._name_maps, self._existing, self._inserted, self._seen = {}, None, set(), set()
+        self._diff_entries = {}
+        
+        for frame, rejected, rows in parts:
+            report.add_rejected(rejected)
             
-            logger.debug(f"Extracted values - MPP: {mpp_discount}, ROP: {opt_discount}")
+            # Resolve every dimension name to an id, loading each table once per sync
+            property_types = self.sync_property_types(frame)
+            payment_types = self.sync_payment_types(frame)
+            complexes = self.sync_complexes(frame)
+            self.sync_discounts(frame, complexes, property_types, payment_types, report)
             
-            # Skip if essential data is missing
-            if not all([complex_name, property_type_name, payment_type_name]):
-                logger.warning(f"Missing required data: complex={complex_name}, "
-                             f"type={property_type_name}, payment={payment_type_name}")
-                continue
-            
-            # Convert discount values, handle percentage format
+            report.processed += rows
+            if self.progress:
+                self.progress(report.processed)
+        
+        self._sync_missing(report)
+        batch = ImportBatch(fingerprint=fingerprint, added=report.inserted, changed=report.updated,
+                            removed=report.removed, unchanged=report.unchanged, created_at=datetime.now(),
+                            source=self._source,
+                            watermark=json.dumps(self._watermark) if self._watermark is not None else None)
+        db.session.add(batch)
+        if report.diff:
+            # The history rows reference the batch, so it needs its id first
+            db.session.flush()
+            discount_history.record_batch(report.diff, batch.id, batch.created_at, self.batch_size)
+        if self.auto_comment and report.diff:
+            text = self._diff_comment(report)
+            db.session.add(Comment(text=text, format=CommentFormat(**build_comment_format(text))))
+        
+        # Commit all changes to the database
+        db.session.commit()
+        
+        # Publish the new data version so every worker rebuilds its discount index
+        if report.diff:
+            discount_cache.invalidate()
+            if self.auto_comment:
+                comment_generation.bump()
+            update_broadcaster.notify()
+        
+        report.elapsed = time.perf_counter() - started
+        metrics.observe_sync(report)
+        logger.info("Discount sync finished: %s", report)
+        return report
+    
+    def sync_property_types(self, frame: pd.DataFrame) -> Dict[str, int]:
+        """
+        Synchronize property types from normalized sheet data.
+        
+        :param frame: Output of normalize_discount_frame
+        :return: Mapping of property type name to id
+        """
+        return self._sync_dimension(PropertyType, frame["property_type"].unique())
+    
+    def sync_payment_types(self, frame: pd.DataFrame) -> Dict[str, int]:
+        """
+        Synchronize payment types from normalized sheet data.
+        
+        :param frame: Output of normalize_discount_frame
+        :return: Mapping of payment type name to id
+        """
+        return self._sync_dimension(PaymentType, frame["payment_type"].unique())
+    
+    def sync_complexes(self, frame: pd.DataFrame) -> Dict[str, int]:
+        """
+        Synchronize complexes from normalized sheet data.
+        
+        :param frame: Output of normalize_discount_frame
+        :return: Mapping of complex name to id
+        """
+        return self._sync_dimension(Complex, frame["complex"].unique())
+    
+    def _sync_dimension(self, model, names: Iterable[str]) -> Dict[str, int]:
+        """
+        Map names to ids, inserting the missing names with one multi-row insert.
+        
+        Names are matched by name_key, as the case- and accent-insensitive collation of the
+        unique name indexes compares them, so "ЖК Парк" finds a stored "жк парк " instead
+        of colliding with it. Should the collation still equate names with different keys,
+        the insert falls back to _insert_names_one_by_one.
+        
+        :param model: PropertyType, PaymentType or Complex
+        :param names: Names found in the source data
+        :return: Mapping of each given name to its id
+        """
+        by_key = self._name_maps.get(model)
+        if by_key is None:
+            by_key = self._name_maps[model] = self._load_names(model)
+        missing: Dict[str, str] = {}
+        for name in names:
+            key = name_key(name)
+            if key not in by_key:
+                missing.setdefault(key, name.strip())
+        if missing:
             try:
-                # Remove any % signs and convert to float
-                mpp_str = str(mpp_discount).replace('%', '').strip() if mpp_discount else '0'
-                opt_str = str(opt_discount).replace('%', '').strip() if opt_discount else '0'
-                kd_str = str(kd_discount).replace('%', '').strip() if kd_discount else '0'
-
-                # Convert to decimal (e.g., 5% becomes 0.05)
-                mpp_disc = (float(mpp_str) * 100.0)/100.0
-                opt_disc = (float(opt_str) * 100.0)/100.0
-                kd_disc = (float(kd_str) * 100.0)/100.0 if kd_str else 0.0
-                
-                logger.debug(f"Converted discounts - MPP: {mpp_disc}, ROP: {opt_disc}")
-            except (ValueError, TypeError) as e:
-                logger.error(f"Error converting discount values: {e}")
-                logger.error(f"Raw values - MPP: {mpp_discount}({type(mpp_discount)}), "
-                           f"ROP: {opt_discount}({type(opt_discount)})")
-                continue
-            
-            # Look up required objects
-            complex_obj = Complex.query.filter_by(name=complex_name).first()
-            prop_type = PropertyType.query.filter_by(name=property_type_name).first()
-            payment_type = PaymentType.query.filter_by(name=payment_type_name).first()
-            
-            if not all([complex_obj, prop_type, payment_type]):
-                logger.warning("Could not find all required database objects")
-                continue
-            
-            # Get or create discount object
-            discount_obj = DiscountObject.query.filter_by(
-                complex_id=complex_obj.id,
-                type_id=prop_type.id,
-                payment_type_id=payment_type.id
+                db.session.execute(db.insert(model), [{'name': name} for name in missing.values()])
+                by_key = self._name_maps[model] = self._load_names(model)
+            except IntegrityError:
+                by_key = self._name_maps[model] = self._insert_names_one_by_one(model, missing)
+            logger.info("Inserted %d new %s rows", len(missing), model.__tablename__)
+        return {name: by_key[name_key(name)][0] for name in names}
+    
+    def _insert_names_one_by_one(self, model, missing: Dict[str, str]) -> Dict[str, Tuple[int, str]]:
+        """
+        Insert names the unique index rejected as a batch, resolving each rejected one.
+        
+        A rejected name maps to the stored row the database itself finds equal to it.
+        MySQL and SQLite roll back only the failed statement, so the transaction goes on.
+        
+        :param missing: name_key -> name of the names to insert
+        :return: name_key -> (id, name) of every stored name, the rejected names included
+        """
+        by_key = self._load_names(model)
+        for key, name in missing.items():
+            if key in by_key:
+                continue  # Inserted before the batch failed
+            row = db.session.execute(
+                db.select(model.id, model.name).where(model.name == name).order_by(model.id).limit(1)
             ).first()
-            
-            if discount_obj:
-                discount_obj.mpp_discount = mpp_disc
-                discount_obj.opt_discount = opt_disc
-                discount_obj.kd_discount = kd_disc
-                logger.debug(f"Updated discount object {discount_obj.id} with "
-                           f"MPP: {mpp_disc}, ROP: {opt_disc}, KD: {kd_disc}")
+            if row is None:
+                db.session.execute(db.insert(model), [{'name': name}])
+                row = db.session.execute(db.select(model.id, model.name).where(model.name == name)).one()
             else:
-                discount_obj = DiscountObject(
-                    complex_id=complex_obj.id,
-                    type_id=prop_type.id,
-                    payment_type_id=payment_type.id,
-                    kd_discount=kd_disc,
-                    mpp_discount=mpp_disc,
-                    opt_discount=opt_disc
-                )
-                db.session.add(discount_obj)
-                logger.debug("Created new discount object")
\ No newline at end of file
+                logger.warning("%s name %r matches the stored %r", model.__tablename__, name, row.name)
+            by_key[key] = (row.id, row.name)
+        return by_key
+    
+    @staticmethod
+    def _load_names(model) -> Dict[str, Tuple[int, str]]:
+        """Map the name_key of every stored name to its (id, name)."""
+        # Descending order keeps the oldest id for duplicated names, as .first() did
+        rows = db.session.execute(db.select(model.id, model.name).order_by(model.id.desc()))
+        return {name_key(name): (id_, name) for id_, name in rows}
+    
+    def sync_discounts(self, frame: pd.DataFrame, complexes: Dict[str, int],
+                       property_types: Dict[str, int], payment_types: Dict[str, int],
+                       report: Optional[SyncReport] = None) -> SyncReport:
+        """
+        Upsert discount information in batches.
+        
+        :param frame: Output of normalize_discount_frame
+        :param complexes: Complex name to id mapping from sync_complexes
+        :param property_types: Property type name to id mapping from sync_property_types
+        :param payment_types: Payment type name to id mapping from sync_payment_types
+        :param report: Report to accumulate counts into
+        :return: The report
+        """
+        report = report or SyncReport()
+        
+        keyed = pd.DataFrame({
+            'complex_id': frame['complex'].map(complexes),
+            'type_id': frame['property_type'].map(property_types),
+            'payment_type_id': frame['payment_type'].map(payment_types),
+            'mpp_discount': frame['mpp_discount'],
+            'opt_discount': frame['opt_discount'],
+            'kd_discount': frame['kd_discount'],
+        })
+        # Later rows win when the sheet repeats a combination
+        keyed = keyed.drop_duplicates(['complex_id', 'type_id', 'payment_type_id'], keep='last')
+        
+        if self._existing is None:
+            self._existing = self._load_existing()
+        
+        inserts, updates, reinserted = [], [], []
+        for complex_id, type_id, payment_type_id, mpp, opt, kd in keyed.itertuples(index=False):
+            key = (int(complex_id), int(type_id), int(payment_type_id))
+            discounts = {'mpp_discount': mpp, 'opt_discount': opt, 'kd_discount': kd}
+            content_hash = discount_hash(mpp, opt, kd)
+            current = self._existing.get(key)
+            if current is not None:
+                self._seen.add(key)
+                discount_id, current_hash = current
+                if current_hash == content_hash:
+                    report.unchanged += 1
+                    continue
+                self._existing[key] = (discount_id, content_hash)
+                updates.append(dict(discounts, id=discount_id))
+                self._record_diff(report, key, discounts, 'changed')
+            elif key in self._inserted:
+                # Repeated in a later chunk of the same sync: the new row has no known id yet
+                reinserted.append(dict(discounts, c_id=key[0], t_id=key[1], p_id=key[2]))
+                self._record_diff(report, key, discounts, 'added')
+            else:
+                self._inserted.add(key)
+                inserts.append(dict(discounts, complex_id=key[0], type_id=key[1], payment_type_id=key[2]))
+                self._record_diff(report, key, discounts, 'added')
+        
+        for start in range(0, len(inserts), self.batch_size):
+            db.session.execute(db.insert(DiscountObject), inserts[start:start + self.batch_size])
+        for start in range(0, len(updates), self.batch_size):
+            db.session.execute(db.update(DiscountObject), updates[start:start + self.batch_size])
+        if reinserted:
+            table = DiscountObject.__table__
+            db.session.execute(
+                table.update()
+                .where(table.c.complex_id == db.bindparam('c_id'),
+                       table.c.type_id == db.bindparam('t_id'),
+                       table.c.payment_type_id == db.bindparam('p_id')),
+                reinserted
+            )
+        
+        report.inserted += len(inserts)
+        report.updated += len(updates)
+        return report
+    
+    def _record_diff(self, report: SyncReport, key: Tuple[int, int, int], discounts: Dict[str, Any], change: str):
+        """Add a combination to the diff, or give its entry the values of a later chunk or sheet."""
+        entry = self._diff_entries.get(key)
+        if entry is not None:
+            entry.update(discounts)
+            return
+        entry = self._diff_entries[key] = dict(discounts, complex_id=key[0], type_id=key[1],
+                                                 payment_type_id=key[2], change=change)
+        report.diff.append(entry)
+    
+    def _load_existing(self) -> Dict[Tuple[int, int, int], Tuple[int, int]]:
+        """Map every stored combination to its (id, content hash)."""
+        rows = db.session.execute(
+            db.select(DiscountObject.id, DiscountObject.complex_id, DiscountObject.type_id,
+                      DiscountObject.payment_type_id, DiscountObject.mpp_discount,
+                      DiscountObject.opt_discount, DiscountObject.kd_discount)
+            .order_by(DiscountObject.id.desc())
+        )
+        return {
+            (complex_id, type_id, payment_type_id): (discount_id, discount_hash(mpp, opt, kd))
+            for discount_id, complex_id, type_id, payment_type_id, mpp, opt, kd in rows
+        }
+    
+    def _sync_missing(self, report: SyncReport):
+        """Account for stored combinations absent from the file, deleting them if SYNC_PRUNE_MISSING is set."""
+        if self._incremental:
+            return  # An incremental pull only carries changed rows; absence means nothing
+        missing = [(key, discount_id) for key, (discount_id, _) in (self._existing or {}).items()
+                   if key not in self._seen]
+        report.removed = len(missing)
+        # Combinations of an unreadable sheet are missing too, but must not be deleted
+        if not missing or not self.prune_missing or report.sheet_errors:
+            return
+        for complex_id, type_id, payment_type_id in (key for key, _ in missing):
+            report.diff.append({'complex_id': complex_id, 'type_id': type_id, 'payment_type_id': payment_type_id,
+                                'mpp_discount': None, 'opt_discount': None, 'kd_discount': None,
+                                'change': 'removed'})
+        ids = [discount_id for _, discount_id in missing]
+        for start in range(0, len(ids), self.batch_size):
+            db.session.execute(db.delete(DiscountObject).where(DiscountObject.id.in_(ids[start:start + self.batch_size])))
+    
+    def _diff_comment(self, report: SyncReport) -> str:
+        """Describe the diff in the "Изменение максимальных скидок" comment format."""
+        names = {model: dict(by_key.values()) for model, by_key in self._name_maps.items()}
+        entries = []
+        for item in report.diff:
+            if item['change'] == 'removed':
+                continue
+            entries.append(
+                f"{names[Complex].get(item['complex_id'], '')} {names[PropertyType].get(item['type_id'], '')} "
+                f"{names[PaymentType].get(item['payment_type_id'], '')} - "
+                f"МПП {round(item['mpp_discount'] * 100, 2)}%, РОП {round(item['opt_discount'] * 100, 2)}%, "
+                f"КД {round(item['kd_discount'] * 100, 2)}%"
+            )
+        text = "Изменение максимальных скидок " + " ".join(entries)
+        # Comment.text is limited to 2000 characters
+        return text if len(text) <= 2000 else text[:1997] + "..."
@@ -0,0 +1,18 @@
+import os
+from typing import List, Optional
+
+# Kept apart from services so that code which only needs the sheet layout, such as
+# the Excel export, does not import pandas
+
+# Sheet column -> field it fills
+NAME_COLUMNS = {"Название": "complex", "Тип": "property_type", "Вид оплаты": "payment_type"}
+DISCOUNT_COLUMNS = {"Скидка МПП": "mpp_discount", "Скидка РОП": "opt_discount", "Скидка КД": "kd_discount"}
+
+# Sheet name selecting every sheet of the workbook, or of every workbook in a zip
+ALL_SHEETS = '*'
+
+
+def configured_columns() -> Optional[List[str]]:
+    """Sheet columns listed in EXCEL_COLUMNS, None when it is not set."""
+    columns_str = os.getenv("EXCEL_COLUMNS")
+    return [col.strip() for col in columns_str.split(',')] if columns_str else None
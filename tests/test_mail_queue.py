@@ -0,0 +1,112 @@
+"""MailQueue delivery against a local aiosmtpd server."""
+import socket
+import sqlite3
+
+import pytest
+from flask import Flask
+
+pytest.importorskip('aiosmtpd')
+from aiosmtpd.controller import Controller  # noqa: E402
+
+from mail_queue import MailQueue  # noqa: E402
+
+
+class Recorder:
+    """aiosmtpd handler keeping every accepted message."""
+
+    def __init__(self):
+        self.messages = []
+
+    async def handle_DATA(self, server, session, envelope):
+        self.messages.append(envelope)
+        return '250 OK'
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+@pytest.fixture
+def smtp_server():
+    recorder = Recorder()
+    controller = Controller(recorder, hostname='127.0.0.1', port=free_port())
+    controller.start()
+    yield controller, recorder
+    controller.stop()
+
+
+@pytest.fixture
+def queue(tmp_path, monkeypatch):
+    def make(port: int, **settings) -> MailQueue:
+        monkeypatch.setenv('EMAIL_SERVER', '127.0.0.1')
+        monkeypatch.setenv('EMAIL_SERVER_PORT', str(port))
+        monkeypatch.setenv('EMAIL_STARTTLS', 'false')
+        monkeypatch.setenv('EMAIL_TIMEOUT', '5')
+        monkeypatch.setenv('SEND_FROM_EMAIL', 'discounts@example.com')
+        monkeypatch.delenv('SEND_FROM_EMAIL_PASSWORD', raising=False)
+        for name, value in settings.items():
+            monkeypatch.setenv(name, str(value))
+        mail_queue = MailQueue()
+        mail_queue.init_app(Flask(__name__, instance_path=str(tmp_path)))
+        return mail_queue
+    return make
+
+
+def rows(mail_queue: MailQueue):
+    conn = sqlite3.connect(mail_queue.db_path)
+    conn.row_factory = sqlite3.Row
+    try:
+        return conn.execute('SELECT * FROM outbound_mail ORDER BY id').fetchall()
+    finally:
+        conn.close()
+
+
+def test_batch_is_sent_over_one_session(smtp_server, queue):
+    controller, recorder = smtp_server
+    mail_queue = queue(controller.port)
+    for number in range(3):
+        mail_queue.enqueue(f'user{number}@example.com', f'Subject {number}', 'Body')
+
+    mail_queue.send_batch(mail_queue._claim())
+
+    assert sorted(envelope.rcpt_tos[0] for envelope in recorder.messages) == [
+        'user0@example.com', 'user1@example.com', 'user2@example.com']
+    assert [(row['state'], row['attempts']) for row in rows(mail_queue)] == [('sent', 1)] * 3
+    assert mail_queue._local.smtp is not None  # Kept open for the next batch
+    mail_queue._close_smtp()
+
+
+def test_stale_session_is_reopened_without_counting_an_attempt(smtp_server, queue):
+    controller, recorder = smtp_server
+    mail_queue = queue(controller.port)
+    mail_queue.enqueue('first@example.com', 'First', 'Body')
+    mail_queue.send_batch(mail_queue._claim())
+    stale = mail_queue._local.smtp
+    # The server side goes away while the session sits idle
+    stale.sock.shutdown(socket.SHUT_RDWR)
+
+    mail_queue.enqueue('second@example.com', 'Second', 'Body')
+    mail_queue.send_batch(mail_queue._claim())
+
+    assert [envelope.rcpt_tos[0] for envelope in recorder.messages] == ['first@example.com', 'second@example.com']
+    assert [(row['state'], row['attempts']) for row in rows(mail_queue)] == [('sent', 1), ('sent', 1)]
+    assert mail_queue._local.smtp is not stale
+    mail_queue._close_smtp()
+
+
+def test_unreachable_server_backs_off_then_dead_letters(queue):
+    mail_queue = queue(free_port(), MAIL_MAX_ATTEMPTS=2, MAIL_RETRY_BASE_SECONDS=60)
+    mail_queue.enqueue('user@example.com', 'Subject', 'Body')
+
+    mail_queue.send_batch(mail_queue._claim())
+    row, = rows(mail_queue)
+    assert (row['state'], row['attempts']) == ('queued', 1)
+    assert row['next_attempt_at'] - row['created_at'] >= 59
+    assert mail_queue._claim() == []  # Not due yet
+
+    mail_queue.send_batch([row])
+    row, = rows(mail_queue)
+    assert (row['state'], row['attempts']) == ('dead', 2)
+    assert mail_queue.requeue_dead() == 1
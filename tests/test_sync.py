@@ -0,0 +1,205 @@
+"""DataSyncService against a temporary SQLite database."""
+import io
+import sqlite3
+
+import pytest
+
+pd = pytest.importorskip('pandas')
+openpyxl = pytest.importorskip('openpyxl')
+
+import migrations  # noqa: E402
+from app import create_app  # noqa: E402
+from models import db, Complex, PropertyType, PaymentType, DiscountObject, ImportBatch  # noqa: E402
+from services import DataSyncService, SQLiteDataService, name_key, normalize_discount_frame  # noqa: E402
+from sheet_schema import ALL_SHEETS, NAME_COLUMNS, DISCOUNT_COLUMNS  # noqa: E402
+
+COLUMNS = list(NAME_COLUMNS) + list(DISCOUNT_COLUMNS)
+SHEET = 'Скидки'
+
+
+@pytest.fixture
+def app(tmp_path, monkeypatch):
+    monkeypatch.setenv('SQLALCHEMY_DATABASE_URI', f"sqlite:///{tmp_path / 'discounts.sqlite3'}")
+    monkeypatch.setenv('EXCEL_SHEET_NAME', SHEET)
+    monkeypatch.setenv('EXCEL_COLUMNS', ','.join(COLUMNS))
+    monkeypatch.setenv('IMPORT_WORKERS', '0')
+    monkeypatch.setenv('MAIL_WORKERS', '0')
+    monkeypatch.setenv('IMPORT_PARSE_PROCESSES', '1')
+    for name in ('DATABASE_REPLICA_URI', 'SYNC_PRUNE_MISSING', 'SYNC_AUTO_COMMENT', 'SQLITE_WATERMARK_COLUMN'):
+        monkeypatch.delenv(name, raising=False)
+    app = create_app(instance_path=str(tmp_path / 'instance'))
+    with app.app_context():
+        migrations.upgrade()
+        yield app
+        db.session.remove()
+
+
+def workbook(*sheets) -> io.BytesIO:
+    """An .xlsx upload with (sheet name, rows) pairs, every sheet in the import layout."""
+    book = openpyxl.Workbook()
+    book.remove(book.active)
+    for title, rows in sheets:
+        sheet = book.create_sheet(title)
+        sheet.append(COLUMNS)
+        for row in rows:
+            sheet.append(row)
+    upload = io.BytesIO()
+    book.save(upload)
+    upload.seek(0)
+    return upload
+
+
+def stored():
+    """Stored discounts as {(complex, type, payment type) names: (mpp, opt, kd)}."""
+    rows = db.session.execute(
+        db.select(Complex.name, PropertyType.name, PaymentType.name,
+                  DiscountObject.mpp_discount, DiscountObject.opt_discount, DiscountObject.kd_discount)
+        .join(Complex, Complex.id == DiscountObject.complex_id)
+        .join(PropertyType, PropertyType.id == DiscountObject.type_id)
+        .join(PaymentType, PaymentType.id == DiscountObject.payment_type_id)
+    )
+    return {tuple(row[:3]): tuple(row[3:]) for row in rows}
+
+
+def test_normalize_converts_percents_and_rejects_bad_rows():
+    frame, rejected = normalize_discount_frame(pd.DataFrame([
+        [' ЖК Парк ', 'Квартира', '100%', '5%', None, 0.01],
+        ['ЖК Парк', 'Квартира', 'Ипотека', 'abc', 0.02, 0.0],
+        [None, 'Квартира', '100%', 0.05, 0.02, 0.0],
+    ], columns=COLUMNS))
+
+    assert frame.to_dict('records') == [{
+        'complex': 'ЖК Парк', 'property_type': 'Квартира', 'payment_type': '100%',
+        'mpp_discount': 5.0, 'opt_discount': 0.0, 'kd_discount': 0.01,
+    }]
+    assert rejected == [
+        {'row': 3, 'reason': 'invalid Скидка МПП: abc'},
+        {'row': 4, 'reason': 'missing Название'},
+    ]
+
+
+def test_name_key_ignores_case_spaces_and_accents():
+    assert name_key(' ЖК Ёлка ') == name_key('жк елка')
+    assert name_key('Café') == name_key('CAFE')
+    assert name_key('ЖК Парк') != name_key('ЖК Парк 2')
+
+
+def test_names_differing_in_case_or_accents_share_one_row(app):
+    DataSyncService().sync_from_upload(workbook((SHEET, [['ЖК Ёлка', 'Квартира', '100%', 0.05, 0, 0]])))
+    report = DataSyncService().sync_from_upload(workbook((SHEET, [['жк елка ', 'квартира', '100%', 0.07, 0, 0]])))
+
+    assert (report.inserted, report.updated) == (0, 1)
+    assert stored() == {('ЖК Ёлка', 'Квартира', '100%'): (0.07, 0.0, 0.0)}
+
+
+def test_resync_writes_only_changed_rows(app):
+    rows = [['ЖК А', 'Квартира', '100%', 0.05, 0.01, 0], ['ЖК Б', 'Квартира', '100%', 0.03, 0.01, 0]]
+    first = DataSyncService().sync_from_upload(workbook((SHEET, rows)))
+    rows[1][3] = 0.04
+    second = DataSyncService().sync_from_upload(workbook((SHEET, rows)))
+
+    assert (first.inserted, first.updated) == (2, 0)
+    assert (second.inserted, second.updated, second.unchanged) == (0, 1, 1)
+    assert [(entry['change'], entry['mpp_discount']) for entry in second.diff] == [('changed', 0.04)]
+
+
+def test_same_upload_twice_is_a_no_op(app):
+    rows = [['ЖК А', 'Квартира', '100%', 0.05, 0, 0]]
+    DataSyncService().sync_from_upload(workbook((SHEET, rows)))
+
+    assert DataSyncService().sync_from_upload(workbook((SHEET, rows))).identical
+    # Read with every sheet the same bytes import other rows, so they are not skipped
+    assert not DataSyncService().sync_from_upload(workbook((SHEET, rows)), ALL_SHEETS).identical
+    assert db.session.query(ImportBatch).count() == 2
+
+
+def test_streamed_upload_matches_chunks_and_keeps_the_last_repeat(app, monkeypatch):
+    monkeypatch.setenv('STREAMING_UPLOAD_THRESHOLD', '0')
+    monkeypatch.setenv('EXCEL_CHUNK_SIZE', '2')
+    rows = [
+        ['ЖК А', 'Квартира', '100%', 0.01, 0, 0],
+        ['ЖК Б', 'Квартира', '100%', 0.02, 0, 0],
+        ['ЖК В', 'Квартира', '100%', 'x', 0, 0],
+        ['ЖК А', 'Квартира', '100%', 0.04, 0, 0],
+        ['ЖК Г', 'Квартира', '100%', 0.05, 0, 0],
+    ]
+    progress = []
+    report = DataSyncService(progress=progress.append).sync_from_upload(workbook((SHEET, rows)))
+
+    assert progress == [2, 4, 5]
+    assert (report.inserted, report.skipped) == (3, 1)
+    assert report.rejected == [{'row': 4, 'reason': 'invalid Скидка МПП: x'}]
+    assert stored()[('ЖК А', 'Квартира', '100%')] == (0.04, 0.0, 0.0)
+    # One diff entry per combination, with the values that were stored
+    assert sorted((entry['change'], entry['mpp_discount']) for entry in report.diff) == [
+        ('added', 0.02), ('added', 0.04), ('added', 0.05)]
+
+
+@pytest.mark.parametrize('processes', ['1', '2'])
+def test_all_sheets_apply_in_order_and_skip_unreadable_ones(app, monkeypatch, processes):
+    monkeypatch.setenv('IMPORT_PARSE_PROCESSES', processes)
+    upload = workbook(
+        ('Север', [['ЖК А', 'Квартира', '100%', 0.01, 0, 0], ['ЖК Б', 'Квартира', '100%', 0.02, 0, 0]]),
+        ('Юг', [['ЖК А', 'Квартира', '100%', 0.03, 0, 0]]),
+    )
+    book = openpyxl.load_workbook(upload)
+    book.create_sheet('Инструкция').append(['Только текст'])
+    upload = io.BytesIO()
+    book.save(upload)
+    upload.seek(0)
+
+    report = DataSyncService().sync_from_upload(upload, ALL_SHEETS)
+
+    assert (report.sheets, report.inserted) == (3, 2)
+    assert [error['sheet'] for error in report.sheet_errors] == ['Инструкция']
+    assert stored()[('ЖК А', 'Квартира', '100%')] == (0.03, 0.0, 0.0)
+    assert sorted(entry['mpp_discount'] for entry in report.diff) == [0.02, 0.03]
+
+
+def test_batch_insert_rejected_by_the_collation_resolves_each_name(app, monkeypatch):
+    # A column collation looser than name_key: names differing in case collide in the index
+    for statement in (
+        "DROP INDEX uq_complex_name",
+        "ALTER TABLE complex RENAME TO complex_old",
+        "CREATE TABLE complex (id INTEGER PRIMARY KEY, name VARCHAR(120) NOT NULL COLLATE NOCASE)",
+        "CREATE UNIQUE INDEX uq_complex_name ON complex (name)",
+        "DROP TABLE complex_old",
+    ):
+        db.session.execute(db.text(statement))
+    db.session.commit()
+    monkeypatch.setattr('services.name_key', str.strip)
+
+    report = DataSyncService().sync_from_upload(workbook((SHEET, [
+        ['park', 'Квартира', '100%', 0.01, 0, 0],
+        ['PARK', 'Квартира', 'Ипотека', 0.02, 0, 0],
+    ])))
+
+    assert report.inserted == 2
+    assert db.session.execute(db.select(Complex.name)).scalars().all() == ['park']
+
+
+def test_sqlite_source_continues_from_the_watermark(app, tmp_path, monkeypatch):
+    monkeypatch.setenv('SQLITE_WATERMARK_COLUMN', 'rowid')
+    path = tmp_path / 'source.sqlite3'
+    source = sqlite3.connect(path)
+    source.execute('CREATE TABLE discounts (complex, type, payment, mpp, opt, kd)')
+    source.executemany('INSERT INTO discounts VALUES (?, ?, ?, ?, ?, ?)', [
+        ('ЖК А', 'Квартира', '100%', 0.01, 0, 0), ('ЖК Б', 'Квартира', '100%', 0.02, 0, 0)])
+    source.commit()
+
+    def sync():
+        service = SQLiteDataService(db_path=str(path), table_name='discounts',
+                                    columns=['complex', 'type', 'payment', 'mpp', 'opt', 'kd'])
+        try:
+            return DataSyncService().sync_from_sqlite(service)
+        finally:
+            service.close()
+
+    assert sync().inserted == 2
+    source.execute("INSERT INTO discounts VALUES ('ЖК В', 'Квартира', '100%', 0.03, 0, 0)")
+    source.commit()
+    source.close()
+    report = sync()
+
+    assert (report.inserted, report.unchanged, report.processed) == (1, 0, 1)
+    assert len(stored()) == 3
@@ -0,0 +1,197 @@
+import os
+import time
+import logging
+import threading
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional, Tuple
+from models import db, Comment, DiscountHistory, ImportBatch
+from discount_cache import discount_cache
+from page_cache import comment_generation
+from comment_format import format_comment_text
+
+logger = logging.getLogger(__name__)
+
+# Sent to a client whose version this worker cannot bridge with deltas
+RESYNC = [{'type': 'discounts', 'reload': True}, {'type': 'comment', 'reload': True}]
+
+
+class UpdateBroadcaster:
+    """
+    Pushes discount and comment changes to open dashboards, one broadcaster per worker.
+
+    A single thread watches the discount and comment generation counters, which any
+    process bumps when it commits, and turns each change into a compact delta: the
+    discount versions the new import batches wrote to the history table, or the new
+    comment. Client requests (SSE streams and long polls) wait on one condition
+    variable for the next delta instead of querying anything themselves.
+
+    A client's position is the version string "<discount generation>:<comment
+    generation>", so a client reconnecting to another worker gets a full reload hint
+    rather than a wrong delta.
+    """
+
+    def __init__(self):
+        self.app = None
+        self.poll_interval = 1.0
+        self.stream_seconds = 55.0
+        self.long_poll_seconds = 25.0
+        self.max_clients = 1
+        self.max_delta = 500
+        self._condition = threading.Condition()
+        self._wakeup = threading.Event()
+        self._events = deque(maxlen=64)  # (version, payloads that lead to it), oldest first
+        self._version: Optional[str] = None
+        self._last_batch_id = 0
+        self._clients = 0
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.app = app
+        self.poll_interval = float(os.getenv('UPDATES_POLL_INTERVAL', self.poll_interval))
+        self.stream_seconds = float(os.getenv('SSE_STREAM_SECONDS', self.stream_seconds))
+        self.long_poll_seconds = float(os.getenv('LONG_POLL_SECONDS', self.long_poll_seconds))
+        # Under gthread every waiting client holds a worker thread, so only one per worker
+        # waits by default; the others are answered at once and poll
+        self.max_clients = int(os.getenv('UPDATES_MAX_CLIENTS', self.max_clients))
+        self.max_delta = int(os.getenv('UPDATES_MAX_DELTA', self.max_delta))
+        app.extensions['updates'] = self
+
+    @staticmethod
+    def current_version() -> str:
+        return f"{discount_cache.generation.read()}:{comment_generation.read()}"
+
+    def start(self):
+        """Start the watcher thread, once per process, when the first client connects."""
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                with self.app.app_context():
+                    self._version = self.current_version()
+                    self._events.append((self._version, []))
+                    self._last_batch_id = db.session.execute(db.select(db.func.max(ImportBatch.id))).scalar() or 0
+                self._thread = threading.Thread(target=self.run_forever, name='update-broadcaster', daemon=True)
+                self._thread.start()
+
+    def notify(self):
+        """Check the counters now instead of at the next poll; for changes made by this process."""
+        self._wakeup.set()
+
+    def acquire(self) -> bool:
+        """Take one of the max_clients waiting slots of this worker; False when all are taken."""
+        with self._lock:
+            if self._clients >= self.max_clients:
+                return False
+            self._clients += 1
+            return True
+
+    def release(self):
+        with self._lock:
+            self._clients -= 1
+
+    @contextmanager
+    def client(self):
+        """
+        Hold a waiting slot for the duration of a request.
+
+        :return: Context manager yielding False when every slot is taken
+        """
+        admitted = self.acquire()
+        try:
+            yield admitted
+        finally:
+            if admitted:
+                self.release()
+
+    def wait(self, since: Optional[str], timeout: float) -> Tuple[List[Dict[str, Any]], str]:
+        """
+        Block until the data moves past `since` or the timeout expires.
+
+        :param since: Version the client has
+        :param timeout: Seconds to wait
+        :return: (payloads, version); no payloads on timeout
+        """
+        deadline = time.monotonic() + timeout
+        with self._condition:
+            while since == self._version:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return [], since
+                self._condition.wait(remaining)
+            return self._payloads_since(since), self._version
+
+    def _payloads_since(self, since: Optional[str]) -> List[Dict[str, Any]]:
+        versions = [version for version, _ in self._events]
+        if since not in versions:
+            return RESYNC
+        payloads = []
+        for _, event_payloads in list(self._events)[versions.index(since) + 1:]:
+            payloads.extend(event_payloads)
+        return payloads
+
+    def run_forever(self):
+        while True:
+            self._wakeup.wait(self.poll_interval)
+            self._wakeup.clear()
+            try:
+                with self.app.app_context():
+                    self._check()
+            except Exception as e:
+                logger.error(f"Update broadcaster check failed: {e}")
+
+    def _check(self):
+        version = self.current_version()
+        if version == self._version:
+            return
+        old_discounts, old_comments = self._version.split(':')
+        new_discounts, new_comments = version.split(':')
+        payloads = []
+        if new_discounts != old_discounts:
+            payloads.append(self._discount_delta())
+        if new_comments != old_comments:
+            payloads.append(self._comment_payload())
+        with self._condition:
+            self._events.append((version, payloads))
+            self._version = version
+            self._condition.notify_all()
+        logger.info("Pushed update %s to waiting dashboards", version)
+
+    def _discount_delta(self) -> Dict[str, Any]:
+        """Versions written by the import batches committed since the last check."""
+        batch_ids = db.session.execute(
+            db.select(ImportBatch.id).where(ImportBatch.id > self._last_batch_id)
+        ).scalars().all()
+        if not batch_ids:
+            return {'type': 'discounts', 'reload': True}
+        self._last_batch_id = max(batch_ids)
+        query = db.select(DiscountHistory).where(DiscountHistory.import_batch_id.in_(batch_ids))
+        if db.session.execute(db.select(db.func.count()).select_from(query.subquery())).scalar() > self.max_delta:
+            return {'type': 'discounts', 'reload': True}
+        changes = {}
+        for version in db.session.execute(query.order_by(DiscountHistory.id)).scalars():
+            key = (version.complex_id, version.type_id, version.payment_type_id)
+            removed = version.mpp_discount is None
+            # [complex_id, type_id, payment_type_id, mpp, opt, kd] in percent, null discounts for removals
+            changes[key] = [*key] + ([None] * 3 if removed else [
+                round(version.mpp_discount*100, 2), round(version.opt_discount*100, 2),
+                round(version.kd_discount*100, 2)])
+        return {'type': 'discounts', 'changes': list(changes.values())}
+
+    @staticmethod
+    def _comment_payload() -> Dict[str, Any]:
+        comment = db.session.execute(
+            db.select(Comment).order_by(Comment.created_at.desc()).limit(1)
+        ).scalars().first()
+        if comment is None:
+            return {'type': 'comment', 'reload': True}
+        return {
+            'type': 'comment',
+            'id': comment.id,
+            'created_at': comment.created_at.isoformat(timespec='seconds'),
+            'formatted_text': comment.format.formatted_text if comment.format else format_comment_text(comment.text),
+        }
+
+
+update_broadcaster = UpdateBroadcaster()
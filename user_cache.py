@@ -0,0 +1,84 @@
+import os
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+
+class UserIdentity:
+    """Read-only snapshot of a User row that can be shared between requests."""
+    __slots__ = ('id', 'login', 'email', 'full_name', 'role')
+
+    def __init__(self, id, login, email, full_name, role):
+        self.id = id
+        self.login = login
+        self.email = email
+        self.full_name = full_name
+        self.role = role
+
+    @classmethod
+    def from_user(cls, user):
+        return cls(user.id, user.login, user.email, user.full_name, user.role)
+
+    def __repr__(self):
+        return f'<User {self.login}>'
+
+
+class UserIdentityCache:
+    """
+    TTL + LRU map of resolved users keyed by the gateway headers.
+
+    Everything stored on a user is derived from the headers, so while they stay the
+    same the user row needs neither a query nor a write.
+    """
+
+    def __init__(self, ttl: float = 300.0, max_size: int = 1024, fallback_ttl: float = 30.0):
+        self.ttl = ttl
+        self.fallback_ttl = fallback_ttl  # For identities that could not be saved
+        self.max_size = max_size
+        self._entries: "OrderedDict[Tuple, Tuple[float, UserIdentity]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.ttl = float(os.getenv('USER_CACHE_TTL', self.ttl))
+        self.max_size = int(os.getenv('USER_CACHE_SIZE', self.max_size))
+        self.fallback_ttl = float(os.getenv('USER_CACHE_FALLBACK_TTL', self.fallback_ttl))
+        app.extensions['user_cache'] = self
+
+    @staticmethod
+    def key_for(headers) -> Tuple:
+        """Cache key of the identity headers set by the gateway."""
+        full_name = (headers.get('X-User-Full-Name', '') + '\0' +
+                     headers.get('X-User-Full-Name-Encoding', ''))
+        return (
+            headers.get('X-User-Name'),
+            headers.get('X-User-Roles'),
+            hashlib.sha1(full_name.encode('utf-8')).digest(),
+        )
+
+    def get(self, key: Tuple) -> Optional[UserIdentity]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, identity = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return identity
+
+    def set(self, key: Tuple, identity: UserIdentity, ttl: Optional[float] = None):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), identity)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+user_cache = UserIdentityCache()